@@ -0,0 +1,64 @@
+# Measures the per-item cost of turning a DynamoDB Query response (wire format) into Task objects: boto3's
+# TypeDeserializer followed by Task.from_item, as the resource-based path did, against decoding the attribute
+# maps directly with Task.from_attributes.
+#
+#   python benchmarks/bench_decode.py
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda_functions", "api_lambda"))
+
+from boto3.dynamodb.types import TypeDeserializer  # noqa: E402
+
+import dynamo  # noqa: E402
+from api_types import Task  # noqa: E402
+
+SIZES = [1000, 10000]
+REPEAT = 5
+
+
+def wire_items(count: int) -> list[dict]:
+    return [
+        {
+            "pk": {"S": "LIST#000042"},
+            "sk": {"S": f"TASK#{task_id:06}"},
+            "taskId": {"N": str(task_id)},
+            "name": {"S": f"Task {task_id}"},
+            "description": {"S": "Something that needs doing before the end of the week"},
+            "state": {"S": "unchecked"},
+        }
+        for task_id in range(1, count + 1)
+    ]
+
+
+def resource_path(items: list[dict]) -> list[Task]:
+    deserializer = TypeDeserializer()
+    return [Task.from_item({name: deserializer.deserialize(value) for name, value in item.items()}) for item in items]
+
+
+def generic_path(items: list[dict]) -> list[Task]:
+    return [Task.from_item(dynamo.deserialize_item(item)) for item in items]
+
+
+def fast_path(items: list[dict]) -> list[Task]:
+    return [Task.from_attributes(item) for item in items]
+
+
+def main() -> None:
+    paths = [
+        ("boto3 TypeDeserializer + from_item", resource_path),
+        ("dynamo.deserialize_item + from_item", generic_path),
+        ("Task.from_attributes", fast_path),
+    ]
+    for size in SIZES:
+        items = wire_items(size)
+        assert resource_path(items) == fast_path(items)
+        print(f"{size} items")
+        for label, path in paths:
+            seconds = min(timeit.repeat(lambda: path(items), number=1, repeat=REPEAT))
+            print(f"  {label:<38} {seconds * 1e3:8.2f} ms {seconds / size * 1e6:8.2f} us/item")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# Measures the per-record cost of util.debug_object on a typical API event at each log level, against the
+# unconditional indented dump it replaced.
+#
+#   python benchmarks/bench_logging.py
+import contextlib
+import importlib
+import io
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda_functions", "api_lambda"))
+
+from events import api_event  # noqa: E402
+
+NUMBER = 20000
+
+
+def legacy_debug_object(obj: object) -> None:
+    print(json.dumps(obj, indent=2, default=str).replace("\n", "\r"))
+
+
+def load_util(level: str, log_format: str):
+    os.environ["LOG_LEVEL"] = level
+    os.environ["LOG_FORMAT"] = log_format
+    import util
+
+    return importlib.reload(util)
+
+
+def bench(label: str, func, event: dict) -> None:
+    with contextlib.redirect_stdout(io.StringIO()):
+        seconds = timeit.timeit(lambda: func(event), number=NUMBER)
+    print(f"{label:<28} {seconds / NUMBER * 1e6:10.2f} us/record")
+
+
+def main() -> None:
+    event = api_event("/task/create", "POST", body={"listId": 12, "name": "Buy milk", "description": "2 litres"})
+
+    bench("legacy (always indented)", legacy_debug_object, event)
+    bench("DEBUG, pretty", load_util("DEBUG", "pretty").debug_object, event)
+    bench("DEBUG, compact", load_util("DEBUG", "compact").debug_object, event)
+    bench("INFO (debug suppressed)", load_util("INFO", "compact").debug_object, event)
+    bench("OFF", load_util("OFF", "compact").debug_object, event)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# Compares the slotted api_types models and api_types.to_json against the plain dataclasses and
+# json.dumps(default=lambda o: o.__dict__) they replaced, for a /list/tasks response: memory per Task and time to
+# serialise the whole body.
+#
+#   python benchmarks/bench_serialize.py
+#   python benchmarks/bench_serialize.py --tasks 50000
+import argparse
+import json
+import os
+import sys
+import timeit
+import tracemalloc
+from dataclasses import dataclass
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "lambda_functions", "api_lambda"))
+
+from api_types import Task, to_json  # noqa: E402
+
+REPEAT = 5
+
+
+@dataclass
+class LegacyTask:
+    id: int
+    name: str
+    description: str
+
+
+def legacy_dumps(body: dict) -> str:
+    return json.dumps(body, default=lambda o: o.__dict__)
+
+
+def build(task_class, count: int) -> list:
+    # Strings are created up front so that only the objects themselves are measured
+    names = [f"Task {task_id}" for task_id in range(count)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tasks = [task_class(id=task_id, name=names[task_id], description="Needs doing") for task_id in range(count)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return tasks, used / count
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=10000)
+    args = parser.parse_args()
+
+    legacy_tasks, legacy_bytes = build(LegacyTask, args.tasks)
+    tasks, slotted_bytes = build(Task, args.tasks)
+    assert json.loads(legacy_dumps({"tasks": legacy_tasks})) == json.loads(to_json({"tasks": tasks}))
+
+    legacy_seconds = min(timeit.repeat(lambda: legacy_dumps({"tasks": legacy_tasks}), number=1, repeat=REPEAT))
+    seconds = min(timeit.repeat(lambda: to_json({"tasks": tasks}), number=1, repeat=REPEAT))
+
+    print(f"{args.tasks} tasks           {'bytes/task':>12} {'serialise ms':>14}")
+    print(f"dataclass + json.dumps {legacy_bytes:12.0f} {legacy_seconds * 1e3:14.2f}")
+    print(f"slotted + to_json      {slotted_bytes:12.0f} {seconds * 1e3:14.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import base64
+import json
+from typing import Optional
+
+USER_POOL_ID = "us-east-1_example"
+
+
+def b64url(data: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+
+def access_token(sub: str = "6bd46626-20e2-4fb0-9696-bd2e6c841d80", kid: str = "key-1") -> str:
+    # Unsigned stand-in for a Cognito access token; only its claims are read by the benchmarks
+    header = {"kid": kid, "alg": "RS256"}
+    claims = {
+        "sub": sub,
+        "iss": f"https://cognito-idp.us-east-1.amazonaws.com/{USER_POOL_ID}",
+        "token_use": "access",
+        "scope": "TinyTodoResourceServer/TinyTodoApi",
+        "exp": 4102444800,
+        "username": sub,
+    }
+    return f"{b64url(header)}.{b64url(claims)}.c2lnbmF0dXJl"
+
+
+ACCESS_TOKEN = access_token()
+
+
+def api_event(
+    resource: str,
+    method: str,
+    body: Optional[dict] = None,
+    query: Optional[dict] = None,
+    token: str = ACCESS_TOKEN,
+    headers: Optional[dict] = None,
+) -> dict:
+    # Shape of an API Gateway REST proxy event as delivered to the API Lambda
+    return {
+        "resource": resource,
+        "path": resource,
+        "httpMethod": method,
+        "headers": {
+            "Accept": "application/json",
+            "Accept-Encoding": "gzip, deflate, br",
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+            "Host": "abcdef1234.execute-api.us-east-1.amazonaws.com",
+            "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko)",
+            "X-Amzn-Trace-Id": "Root=1-652e4f2a-0f1e2d3c4b5a69788796a5b4",
+            "X-Forwarded-For": "203.0.113.10",
+            "X-Forwarded-Port": "443",
+            "X-Forwarded-Proto": "https",
+            **(headers or {}),
+        },
+        "multiValueHeaders": {},
+        "queryStringParameters": query,
+        "multiValueQueryStringParameters": None,
+        "pathParameters": None,
+        "stageVariables": None,
+        "requestContext": {
+            "resourcePath": resource,
+            "httpMethod": method,
+            "path": f"/prod{resource}",
+            "protocol": "HTTP/1.1",
+            "stage": "prod",
+            "requestId": "c6af9ac6-7b61-11e6-9a41-93e8deadbeef",
+            "identity": {"sourceIp": "203.0.113.10", "userAgent": "Mozilla/5.0"},
+            "authorizer": {"claims": {"scope": "TinyTodoResourceServer/TinyTodoApi"}},
+        },
+        "body": json.dumps(body) if body is not None else None,
+        "isBase64Encoded": False,
+    }
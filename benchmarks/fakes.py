@@ -0,0 +1,689 @@
+# In-process stand-ins for the AWS services the API Lambda talks to: an in-memory DynamoDB table (resource and
+# low-level client shapes) and a Verified Permissions client that evaluates the TinyTodo policy model locally.
+# Every call is counted and can be given an artificial latency so that caching and batching show up in timings.
+import json
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Callable, Optional
+
+from boto3.dynamodb.conditions import ConditionBase, ConditionExpressionBuilder
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+EDITOR_TEMPLATE_ID = "editor-template"
+VIEWER_TEMPLATE_ID = "viewer-template"
+POLICY_STORE_ID = "local-policy-store"
+
+APPLICATION_ACTIONS = {"CreateList", "ListLists", "ListSharedLists"}
+VIEWER_ACTIONS = {"ReadList", "ListTasks", "ReadTask"}
+EDITOR_ACTIONS = VIEWER_ACTIONS | {"UpdateList", "CreateTask", "UpdateTask", "DeleteTask"}
+OWNER_ACTIONS = {"DeleteList", "ListShares", "ReadShare", "CreateShare", "UpdateShare", "DeleteShare"}
+
+TEMPLATE_STATEMENTS = {
+    EDITOR_TEMPLATE_ID: (
+        "permit (principal == ?principal, action in ["
+        + ", ".join(f'TinyTodo::Action::"{action}"' for action in sorted(EDITOR_ACTIONS))
+        + "], resource == ?resource);"
+    ),
+    VIEWER_TEMPLATE_ID: (
+        "permit (principal == ?principal, action in ["
+        + ", ".join(f'TinyTodo::Action::"{action}"' for action in sorted(VIEWER_ACTIONS))
+        + "], resource == ?resource);"
+    ),
+}
+STATIC_STATEMENTS = {
+    "owner-policy": "permit (principal, action, resource is TinyTodo::List) when { resource.owner == principal };",
+    "application-policy": (
+        'permit (principal, action in TinyTodo::Action::"ApplicationActions", '
+        'resource == TinyTodo::Application::"TinyTodo");'
+    ),
+}
+# The actions of the schema; the application-level ones are grouped, as the application policy refers to the group
+SCHEMA = {
+    "TinyTodo": {
+        "entityTypes": {"User": {}, "Application": {}, "List": {}},
+        "actions": {
+            "ApplicationActions": {},
+            **{
+                action: {"memberOf": [{"id": "ApplicationActions"}]} if action in APPLICATION_ACTIONS else {}
+                for action in sorted(APPLICATION_ACTIONS | EDITOR_ACTIONS | OWNER_ACTIONS)
+            },
+        },
+    }
+}
+
+
+class CallCounter:
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, operation: str, latency: float) -> None:
+        with self.lock:
+            self.counts[operation] += 1
+        if latency:
+            time.sleep(latency)
+
+    def snapshot(self) -> Counter:
+        with self.lock:
+            return Counter(self.counts)
+
+
+def client_error(code: str, operation: str, message: str = "", **extra) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": message or code}, **extra}, operation)
+
+
+# -- DynamoDB expressions --------------------------------------------------------------------------------------
+
+TOKEN_RE = re.compile(r"\s*(<>|<=|>=|=|<|>|\(|\)|,|\+|-|[#:]?[A-Za-z_][A-Za-z0-9_.]*)")
+
+
+def tokenize(expression: str) -> list:
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = TOKEN_RE.match(expression, position)
+        if not match:
+            raise ValueError(f"Cannot parse expression at: {expression[position:]}")
+        tokens.append(match.group(1))
+        position = match.end()
+    return tokens
+
+
+class ConditionParser:
+    def __init__(self, expression: str, names: dict, values: dict):
+        self.tokens = tokenize(expression)
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self) -> Optional[str]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self, expected: Optional[str] = None) -> str:
+        token = self.peek()
+        if expected is not None and (token or "").upper() != expected:
+            raise ValueError(f"Expected {expected}, got {token}")
+        self.position += 1
+        return token
+
+    def parse(self) -> Callable[[dict], bool]:
+        condition = self.parse_or()
+        if self.peek() is not None:
+            raise ValueError(f"Unexpected token {self.peek()}")
+        return condition
+
+    def parse_or(self):
+        left = self.parse_and()
+        while (self.peek() or "").upper() == "OR":
+            self.take()
+            right = self.parse_and()
+            left = (lambda a, b: lambda item: a(item) or b(item))(left, right)
+        return left
+
+    def parse_and(self):
+        left = self.parse_not()
+        while (self.peek() or "").upper() == "AND":
+            self.take()
+            right = self.parse_not()
+            left = (lambda a, b: lambda item: a(item) and b(item))(left, right)
+        return left
+
+    def parse_not(self):
+        if (self.peek() or "").upper() == "NOT":
+            self.take()
+            inner = self.parse_not()
+            return lambda item: not inner(item)
+        return self.parse_primary()
+
+    def parse_primary(self):
+        token = self.peek()
+        if token == "(":
+            self.take()
+            inner = self.parse_or()
+            self.take(")")
+            return inner
+
+        lowered = token.lower()
+        if lowered in ("attribute_exists", "attribute_not_exists", "begins_with", "contains"):
+            self.take()
+            self.take("(")
+            path = self.operand()
+            argument = None
+            if self.peek() == ",":
+                self.take()
+                argument = self.operand()
+            self.take(")")
+            if lowered == "attribute_exists":
+                return lambda item: path(item) is not None
+            if lowered == "attribute_not_exists":
+                return lambda item: path(item) is None
+            if lowered == "begins_with":
+                return lambda item: isinstance(path(item), str) and path(item).startswith(argument(item))
+            return lambda item: path(item) is not None and argument(item) in path(item)
+
+        left = self.operand()
+        operator = self.take().upper()
+        if operator == "BETWEEN":
+            low = self.operand()
+            self.take("AND")
+            high = self.operand()
+            return lambda item: left(item) is not None and low(item) <= left(item) <= high(item)
+        right = self.operand()
+        comparisons = {
+            "=": lambda a, b: a == b,
+            "<>": lambda a, b: a != b,
+            "<": lambda a, b: a is not None and a < b,
+            "<=": lambda a, b: a is not None and a <= b,
+            ">": lambda a, b: a is not None and a > b,
+            ">=": lambda a, b: a is not None and a >= b,
+        }
+        compare = comparisons[operator]
+        return lambda item: compare(left(item), right(item))
+
+    def operand(self):
+        token = self.take()
+        if token.startswith(":"):
+            value = self.values[token]
+            return lambda item: value
+        name = self.names.get(token, token)
+        return lambda item: item.get(name)
+
+
+def compile_condition(expression, names: Optional[dict] = None, values: Optional[dict] = None, key=False):
+    names = dict(names or {})
+    values = dict(values or {})
+    if isinstance(expression, ConditionBase):
+        built = ConditionExpressionBuilder().build_expression(expression, is_key_condition=key)
+        expression = built.condition_expression
+        names.update(built.attribute_name_placeholders)
+        values.update(built.attribute_value_placeholders)
+    return ConditionParser(expression, names, values).parse()
+
+
+def apply_update(item: dict, expression: str, names: Optional[dict], values: Optional[dict]) -> set:
+    names = names or {}
+    values = values or {}
+    changed = set()
+    clauses = re.split(r"\b(SET|ADD|REMOVE|DELETE)\b", expression, flags=re.IGNORECASE)
+    for keyword, body in zip(clauses[1::2], clauses[2::2]):
+        keyword = keyword.upper()
+        for action in (part.strip() for part in re.split(r",(?![^(]*\))", body) if part.strip()):
+            if keyword == "SET":
+                path, value_expression = (side.strip() for side in action.split("=", 1))
+                name = names.get(path, path)
+                item[name] = evaluate_value(item, value_expression, names, values)
+            elif keyword == "ADD":
+                path, value = action.split()
+                name = names.get(path, path)
+                item[name] = item.get(name, Decimal(0)) + values[value]
+            elif keyword == "REMOVE":
+                name = names.get(action, action)
+                item.pop(name, None)
+            changed.add(name)
+    return changed
+
+
+def evaluate_value(item: dict, expression: str, names: dict, values: dict):
+    match = re.match(r"if_not_exists\(\s*(\S+)\s*,\s*(\S+)\s*\)$", expression)
+    if match:
+        existing = item.get(names.get(match.group(1), match.group(1)))
+        return existing if existing is not None else values[match.group(2)]
+
+    for operator in ("+", "-"):
+        if operator in expression:
+            left, right = (evaluate_value(item, side.strip(), names, values) for side in expression.split(operator, 1))
+            return left + right if operator == "+" else left - right
+
+    if expression.startswith(":"):
+        return values[expression]
+    return item.get(names.get(expression, expression))
+
+
+def project(item: dict, projection: Optional[str], names: Optional[dict]) -> dict:
+    if not projection:
+        return dict(item)
+    names = names or {}
+    attributes = [names.get(part.strip(), part.strip()) for part in projection.split(",")]
+    return {name: item[name] for name in attributes if name in item}
+
+
+# -- DynamoDB table --------------------------------------------------------------------------------------------
+
+serializer = TypeSerializer()
+deserializer = TypeDeserializer()
+
+
+def to_wire(item: dict) -> dict:
+    return {name: serializer.serialize(value) for name, value in item.items()}
+
+
+def from_wire(item: dict) -> dict:
+    return {name: deserializer.deserialize(value) for name, value in item.items()}
+
+
+class FakeTable:
+    # Mirrors the boto3 Table resource methods used by database.py. Items are copied on the way in and out, as
+    # they would be by serialisation, so callers cannot mutate the store. With raw=True keys, values and items are
+    # in the low-level client's wire format, as with dynamo.Table.
+    INDEXES = {"OwnerListIdIndex": ("owner", "listId")}
+
+    def __init__(
+        self,
+        name: str = "TinyTodoTable",
+        calls: Optional[CallCounter] = None,
+        latency: float = 0.0,
+        page_items: int = 1000,
+    ):
+        self.name = name
+        self.calls = calls or CallCounter()
+        self.latency = latency
+        self.page_items = page_items
+        self.items = {}
+        self.lock = threading.RLock()
+
+    def _record(self, operation: str) -> None:
+        self.calls.record(f"dynamodb.{operation}", self.latency)
+
+    @staticmethod
+    def _key(key: dict) -> tuple:
+        return (key["pk"], key["sk"])
+
+    def _check(self, operation: str, current: Optional[dict], condition, names, values) -> None:
+        if condition and not compile_condition(condition, names, values)(current or {}):
+            raise client_error("ConditionalCheckFailedException", operation, "The conditional request failed")
+
+    def seed(self, items: list) -> None:
+        with self.lock:
+            for item in items:
+                self.items[self._key(item)] = dict(item)
+
+    def get_item(self, Key, ProjectionExpression=None, ExpressionAttributeNames=None, ConsistentRead=False, raw=False):
+        self._record("GetItem")
+        with self.lock:
+            item = self.items.get(self._key(from_wire(Key) if raw else Key))
+            if item is None:
+                return {}
+            item = project(item, ProjectionExpression, ExpressionAttributeNames)
+        return {"Item": to_wire(item) if raw else item}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None):
+        self._record("PutItem")
+        with self.lock:
+            self._check(
+                "PutItem",
+                self.items.get(self._key(Item)),
+                ConditionExpression,
+                ExpressionAttributeNames,
+                ExpressionAttributeValues,
+            )
+            self.items[self._key(Item)] = dict(Item)
+        return {}
+
+    def update_item(
+        self,
+        Key,
+        UpdateExpression,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+        ConditionExpression=None,
+        ReturnValues="NONE",
+    ):
+        self._record("UpdateItem")
+        with self.lock:
+            current = self.items.get(self._key(Key))
+            self._check("UpdateItem", current, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+            old = dict(current) if current else {}
+            new = dict(old) if old else dict(Key)
+            changed = apply_update(new, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+            self.items[self._key(Key)] = new
+
+        if ReturnValues == "UPDATED_OLD":
+            return {"Attributes": {name: old[name] for name in changed if name in old}}
+        if ReturnValues == "UPDATED_NEW":
+            return {"Attributes": {name: new[name] for name in changed if name in new}}
+        if ReturnValues == "ALL_NEW":
+            return {"Attributes": dict(new)}
+        if ReturnValues == "ALL_OLD":
+            return {"Attributes": old}
+        return {}
+
+    def delete_item(
+        self,
+        Key,
+        ConditionExpression=None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+        ReturnValues="NONE",
+    ):
+        self._record("DeleteItem")
+        with self.lock:
+            current = self.items.get(self._key(Key))
+            self._check("DeleteItem", current, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+            self.items.pop(self._key(Key), None)
+        return {"Attributes": dict(current)} if ReturnValues == "ALL_OLD" and current else {}
+
+    def query(
+        self,
+        KeyConditionExpression,
+        IndexName=None,
+        Select=None,
+        Limit=None,
+        ExclusiveStartKey=None,
+        ProjectionExpression=None,
+        ExpressionAttributeNames=None,
+        ExpressionAttributeValues=None,
+        FilterExpression=None,
+        ScanIndexForward=True,
+        ConsistentRead=False,
+        raw=False,
+    ):
+        self._record("Query")
+        if raw and ExpressionAttributeValues:
+            ExpressionAttributeValues = from_wire(ExpressionAttributeValues)
+        matches = compile_condition(
+            KeyConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues, key=True
+        )
+        if IndexName:
+            hash_key, range_key = self.INDEXES[IndexName]
+        else:
+            hash_key, range_key = "pk", "sk"
+
+        def sort_key(item):
+            return (item[hash_key], item[range_key], item["pk"], item["sk"])
+
+        with self.lock:
+            items = sorted(
+                (item for item in self.items.values() if hash_key in item and range_key in item and matches(item)),
+                key=sort_key,
+                reverse=not ScanIndexForward,
+            )
+
+        if ExclusiveStartKey:
+            start = sort_key(ExclusiveStartKey)
+            items = [item for item in items if (sort_key(item) > start) == ScanIndexForward and sort_key(item) != start]
+
+        page_size = min(Limit or self.page_items, self.page_items)
+        page = items[:page_size]
+        if FilterExpression:
+            keep = compile_condition(FilterExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+            page = [item for item in page if keep(item)]
+
+        resp = {"Count": len(page), "ScannedCount": len(page)}
+        if Select != "COUNT":
+            resp["Items"] = [project(item, ProjectionExpression, ExpressionAttributeNames) for item in page]
+            if raw:
+                resp["Items"] = [to_wire(item) for item in resp["Items"]]
+        if len(items) > page_size:
+            last = items[page_size - 1]
+            resp["LastEvaluatedKey"] = {name: last[name] for name in {"pk", "sk", hash_key, range_key}}
+        return resp
+
+
+class FakeDynamoDB:
+    # Stand-in for boto3.resource("dynamodb")
+    def __init__(self, table: FakeTable, unprocessed_every: int = 0):
+        self.table = table
+        self.unprocessed_every = unprocessed_every
+
+    def Table(self, name: str) -> FakeTable:
+        assert name == self.table.name
+        return self.table
+
+    def batch_get_item(self, RequestItems, raw=False):
+        self.table._record("BatchGetItem")
+        request = RequestItems[self.table.name]
+        if len(request["Keys"]) > 100:
+            raise client_error("ValidationException", "BatchGetItem", "Too many items requested")
+
+        found, unprocessed = [], []
+        with self.table.lock:
+            for index, key in enumerate(request["Keys"]):
+                if self.unprocessed_every and index % self.unprocessed_every == self.unprocessed_every - 1:
+                    unprocessed.append(key)
+                    continue
+                item = self.table.items.get(FakeTable._key(from_wire(key) if raw else key))
+                if item is not None:
+                    item = project(item, request.get("ProjectionExpression"), request.get("ExpressionAttributeNames"))
+                    found.append(to_wire(item) if raw else item)
+
+        resp = {"Responses": {self.table.name: found}, "UnprocessedKeys": {}}
+        if unprocessed:
+            resp["UnprocessedKeys"] = {self.table.name: {**request, "Keys": unprocessed}}
+        return resp
+
+    def transact_write_items(self, TransactItems):
+        self.table._record("TransactWriteItems")
+        if len(TransactItems) > 100:
+            raise client_error("ValidationException", "TransactWriteItems", "Too many items in the transaction")
+
+        actions = [next(iter(action.items())) for action in TransactItems]
+        keys = [FakeTable._key(request.get("Item") or request["Key"]) for _, request in actions]
+        if len(set(keys)) != len(keys):
+            raise client_error("ValidationException", "TransactWriteItems", "Duplicate item in the transaction")
+
+        with self.table.lock:
+            # Every condition is checked before anything is written, so a cancelled transaction changes nothing
+            reasons = []
+            for (_, request), key in zip(actions, keys):
+                condition = request.get("ConditionExpression")
+                names, values = request.get("ExpressionAttributeNames"), request.get("ExpressionAttributeValues")
+                ok = not condition or compile_condition(condition, names, values)(self.table.items.get(key) or {})
+                reasons.append("None" if ok else "ConditionalCheckFailed")
+            if any(reason != "None" for reason in reasons):
+                raise client_error(
+                    "TransactionCanceledException",
+                    "TransactWriteItems",
+                    f"Transaction cancelled, reasons [{', '.join(reasons)}]",
+                    CancellationReasons=[{"Code": reason} for reason in reasons],
+                )
+
+            for (operation, request), key in zip(actions, keys):
+                if operation == "Put":
+                    self.table.items[key] = dict(request["Item"])
+                elif operation == "Delete":
+                    self.table.items.pop(key, None)
+                elif operation == "Update":
+                    item = dict(self.table.items.get(key) or request["Key"])
+                    apply_update(
+                        item,
+                        request["UpdateExpression"],
+                        request.get("ExpressionAttributeNames"),
+                        request.get("ExpressionAttributeValues"),
+                    )
+                    self.table.items[key] = item
+        return {}
+
+
+# -- Verified Permissions --------------------------------------------------------------------------------------
+
+
+class FakeVerifiedPermissions:
+    # Evaluates the TinyTodo model: list owners may do anything to their lists, anybody may use the
+    # application-level actions, and template-linked editor/viewer policies grant their template's actions on one
+    # list to one user.
+    def __init__(self, calls: Optional[CallCounter] = None, latency: float = 0.0, page_size: int = 20):
+        self.calls = calls or CallCounter()
+        self.latency = latency
+        self.page_size = page_size
+        self.policies = {}
+        self.lock = threading.Lock()
+        now = datetime.now(timezone.utc)
+        for policy_id, statement in STATIC_STATEMENTS.items():
+            self.policies[policy_id] = {
+                "policyStoreId": POLICY_STORE_ID,
+                "policyId": policy_id,
+                "policyType": "STATIC",
+                "definition": {"static": {"description": policy_id, "statement": statement}},
+                "createdDate": now,
+                "lastUpdatedDate": now,
+            }
+
+    def _record(self, operation: str) -> None:
+        self.calls.record(f"avp.{operation}", self.latency)
+
+    def link(self, template_id: str, user: str, list_id) -> str:
+        policy_id = uuid.uuid4().hex
+        principal = {"entityType": "TinyTodo::User", "entityId": user}
+        resource = {"entityType": "TinyTodo::List", "entityId": str(list_id)}
+        now = datetime.now(timezone.utc)
+        with self.lock:
+            self.policies[policy_id] = {
+                "policyStoreId": POLICY_STORE_ID,
+                "policyId": policy_id,
+                "policyType": "TEMPLATE_LINKED",
+                "principal": principal,
+                "resource": resource,
+                "definition": {
+                    "templateLinked": {"policyTemplateId": template_id, "principal": principal, "resource": resource}
+                },
+                "createdDate": now,
+                "lastUpdatedDate": now,
+            }
+        return policy_id
+
+    def _decide(self, principal: dict, action: str, resource: dict, entities: dict) -> tuple:
+        if resource["entityType"] == "TinyTodo::Application":
+            return ("ALLOW", ["application-policy"]) if action in APPLICATION_ACTIONS else ("DENY", [])
+
+        for entity in entities.get("entityList", []):
+            if entity["identifier"] == resource:
+                owner = entity.get("attributes", {}).get("owner", {}).get("entityIdentifier")
+                if owner == principal:
+                    return "ALLOW", ["owner-policy"]
+
+        with self.lock:
+            linked = [
+                policy
+                for policy in self.policies.values()
+                if policy.get("principal") == principal and policy.get("resource") == resource
+            ]
+        for policy in linked:
+            template_id = policy["definition"]["templateLinked"]["policyTemplateId"]
+            actions = EDITOR_ACTIONS if template_id == EDITOR_TEMPLATE_ID else VIEWER_ACTIONS
+            if action in actions:
+                return "ALLOW", [policy["policyId"]]
+        return "DENY", []
+
+    def is_authorized(self, policyStoreId, principal, action, resource, entities=None, context=None):
+        self._record("IsAuthorized")
+        decision, determining = self._decide(principal, action["actionId"], resource, entities or {})
+        return {
+            "decision": decision,
+            "determiningPolicies": [{"policyId": policy_id} for policy_id in determining],
+            "errors": [],
+        }
+
+    def create_policy(self, policyStoreId, definition, clientToken=None):
+        self._record("CreatePolicy")
+        linked = definition["templateLinked"]
+        principal, resource = linked["principal"], linked["resource"]
+        with self.lock:
+            for policy in self.policies.values():
+                if (
+                    policy.get("principal") == principal
+                    and policy.get("resource") == resource
+                    and policy["definition"]["templateLinked"]["policyTemplateId"] == linked["policyTemplateId"]
+                ):
+                    raise client_error("ConflictException", "CreatePolicy", "Policy already exists")
+        policy_id = self.link(linked["policyTemplateId"], principal["entityId"], resource["entityId"])
+        policy = self.policies[policy_id]
+        return {key: policy[key] for key in policy if key != "definition"}
+
+    def get_policy(self, policyStoreId, policyId):
+        self._record("GetPolicy")
+        with self.lock:
+            if policyId not in self.policies:
+                raise client_error("ResourceNotFoundException", "GetPolicy")
+            return dict(self.policies[policyId])
+
+    def update_policy(self, policyStoreId, policyId, definition):
+        self._record("UpdatePolicy")
+        with self.lock:
+            policy = self.policies.get(policyId)
+            if policy is None:
+                raise client_error("ResourceNotFoundException", "UpdatePolicy")
+            if "static" not in policy["definition"] or "static" not in definition:
+                raise client_error("ValidationException", "UpdatePolicy", "Only static policies can be updated")
+            policy["definition"] = {"static": dict(definition["static"])}
+            policy["lastUpdatedDate"] = datetime.now(timezone.utc)
+            return {key: policy[key] for key in policy if key != "definition"}
+
+    def delete_policy(self, policyStoreId, policyId):
+        self._record("DeletePolicy")
+        with self.lock:
+            if self.policies.pop(policyId, None) is None:
+                raise client_error("ResourceNotFoundException", "DeletePolicy")
+        return {}
+
+    def list_policies(self, policyStoreId, filter=None, nextToken=None, maxResults=None):
+        self._record("ListPolicies")
+        filter = filter or {}
+        with self.lock:
+            policies = list(self.policies.values())
+        for field in ("principal", "resource"):
+            if "identifier" in filter.get(field, {}):
+                policies = [policy for policy in policies if policy.get(field) == filter[field]["identifier"]]
+        if "policyType" in filter:
+            policies = [policy for policy in policies if policy["policyType"] == filter["policyType"]]
+        if "policyTemplateId" in filter:
+            policies = [
+                policy
+                for policy in policies
+                if policy["definition"].get("templateLinked", {}).get("policyTemplateId") == filter["policyTemplateId"]
+            ]
+
+        start = int(nextToken or 0)
+        end = start + min(maxResults or self.page_size, self.page_size)
+        items = []
+        for policy in policies[start:end]:
+            item = dict(policy)
+            if "static" in item["definition"]:
+                item["definition"] = {"static": {"description": item["definition"]["static"]["description"]}}
+            items.append(item)
+        resp = {"policies": items}
+        if end < len(policies):
+            resp["nextToken"] = str(end)
+        return resp
+
+    def get_policy_template(self, policyStoreId, policyTemplateId):
+        self._record("GetPolicyTemplate")
+        now = datetime.now(timezone.utc)
+        return {
+            "policyStoreId": policyStoreId,
+            "policyTemplateId": policyTemplateId,
+            "statement": TEMPLATE_STATEMENTS[policyTemplateId],
+            "createdDate": now,
+            "lastUpdatedDate": now,
+        }
+
+    def get_schema(self, policyStoreId):
+        self._record("GetSchema")
+        now = datetime.now(timezone.utc)
+        return {
+            "policyStoreId": policyStoreId,
+            "schema": json.dumps(SCHEMA),
+            "createdDate": now,
+            "lastUpdatedDate": now,
+        }
+
+    def list_policy_templates(self, policyStoreId, nextToken=None, maxResults=None):
+        self._record("ListPolicyTemplates")
+        now = datetime.now(timezone.utc)
+        return {
+            "policyTemplates": [
+                {
+                    "policyStoreId": policyStoreId,
+                    "policyTemplateId": template_id,
+                    "createdDate": now,
+                    "lastUpdatedDate": now,
+                }
+                for template_id in TEMPLATE_STATEMENTS
+            ]
+        }
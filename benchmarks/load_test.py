@@ -0,0 +1,384 @@
+# Replays a synthetic traffic mix through the real api_lambda handler, in-process, against the stand-ins in
+# fakes.py, and reports per-action latency, throughput and downstream calls per request.
+#
+#   python benchmarks/load_test.py --requests 2000 --dynamodb-latency-ms 4 --avp-latency-ms 12
+#   python benchmarks/load_test.py --save baseline.json
+#   python benchmarks/load_test.py --compare baseline.json --tolerance 0.2   # exits 1 on regression
+import argparse
+import base64
+import gzip
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import zlib
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "lambda_functions", "api_lambda"))
+
+import fakes  # noqa: E402
+from events import USER_POOL_ID, access_token, api_event  # noqa: E402
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("LOG_LEVEL", "OFF")
+os.environ["POLICY_STORE_ID"] = fakes.POLICY_STORE_ID
+os.environ["TASK_LIST_EDITOR_TEMPLATE_ID"] = fakes.EDITOR_TEMPLATE_ID
+os.environ["TASK_LIST_VIEWER_TEMPLATE_ID"] = fakes.VIEWER_TEMPLATE_ID
+os.environ.pop("COGNITO_ISSUER", None)
+
+import concurrency  # noqa: E402
+import database  # noqa: E402
+import handler  # noqa: E402
+import permissions  # noqa: E402
+
+# Relative weights of each API action in the replayed traffic
+DEFAULT_MIX = {
+    "ListLists": 12,
+    "ListSharedLists": 6,
+    "ReadList": 10,
+    "ListTasks": 20,
+    "ReadTask": 2,
+    "CreateList": 2,
+    "UpdateList": 3,
+    "DeleteList": 1,
+    "CreateTask": 10,
+    "UpdateTask": 8,
+    "DeleteTask": 4,
+    "BatchCreateTasks": 1,
+    "BatchUpdateTasks": 1,
+    "BatchDeleteTasks": 1,
+    "ListShares": 6,
+    "ReadShare": 2,
+    "CreateShare": 3,
+    "UpdateShare": 2,
+    "DeleteShare": 2,
+}
+ROUTES = {action: route for route, action in handler.ACTIONS.items()}
+
+
+class World:
+    # What the harness believes is in the stores, used to build requests that refer to real lists, tasks and
+    # shares. It is updated from successful responses.
+    def __init__(self, rng: random.Random, users: int, lists_per_user: int, tasks_per_list: int, shares: int):
+        self.rng = rng
+        self.users = [f"user-{index:04}" for index in range(users)]
+        self.lists = {}
+        self.tasks = defaultdict(list)
+        self.shares = {}
+        self.next_list_id = 1
+        self.lists_per_user = lists_per_user
+        self.tasks_per_list = tasks_per_list
+        self.initial_shares = shares
+
+    @staticmethod
+    def principal(user: str) -> str:
+        return f"{USER_POOL_ID}|{user}"
+
+    def seed(self, table: fakes.FakeTable, avp: fakes.FakeVerifiedPermissions) -> None:
+        items = []
+        for user in self.users:
+            items.append({"pk": self.principal(user), "sk": user})
+            items.append({"pk": user, "sk": self.principal(user)})
+            for _ in range(self.lists_per_user):
+                list_id = self.next_list_id
+                self.next_list_id += 1
+                self.lists[list_id] = user
+                for task_id in range(1, self.tasks_per_list + 1):
+                    items.append(
+                        {
+                            "pk": database.list_key(list_id),
+                            "sk": database.task_key(task_id),
+                            "name": f"Task {task_id}",
+                            "description": "Something that needs doing " * 4,
+                            "listId": Decimal(list_id),
+                            "taskId": Decimal(task_id),
+                        }
+                    )
+                    self.tasks[list_id].append(task_id)
+                items.append(
+                    {
+                        "pk": database.list_key(list_id),
+                        "sk": "DETAILS",
+                        "name": f"List {list_id}",
+                        "description": f"List {list_id} of {user}",
+                        "listId": Decimal(list_id),
+                        "owner": self.principal(user),
+                        "nextTaskId": Decimal(self.tasks_per_list + 1),
+                        "taskCount": Decimal(self.tasks_per_list),
+                    }
+                )
+        items.append({"pk": "GLOBAL", "sk": "GLOBAL", "nextListId": Decimal(self.next_list_id)})
+        table.seed(items)
+
+        # The initial shares come with their records, as after tools/reconcile_share_records.py
+        records = []
+        for _ in range(self.initial_shares):
+            list_id = self.rng.choice(list(self.lists))
+            user = self.rng.choice(self.users)
+            if user != self.lists[list_id] and (list_id, user) not in self.shares:
+                role = self.rng.choice(["editor", "viewer"])
+                template = fakes.EDITOR_TEMPLATE_ID if role == "editor" else fakes.VIEWER_TEMPLATE_ID
+                policy_id = avp.link(template, self.principal(user), list_id)
+                records.extend(database.share_items(list_id, self.principal(user), role, policy_id))
+                self.shares[(list_id, user)] = role
+        table.seed(records)
+
+    def owned(self, user: str) -> list:
+        return [list_id for list_id, owner in self.lists.items() if owner == user]
+
+    def request(self, action: str):
+        # Returns (user, body, query) for one request of the given action, or None if the world has nothing the
+        # action could apply to right now
+        rng = self.rng
+        user = rng.choice(self.users)
+        owned = self.owned(user)
+        if action == "ListLists":
+            return user, None, {"fields": "id,name"} if rng.random() < 0.5 else {}
+        if action == "ListSharedLists":
+            return user, None, {}
+        if action == "CreateList":
+            body = {"name": "New list", "description": "Created by the load test"}
+            if rng.random() < 0.5:
+                body["tasks"] = [{"name": f"Starter {n}", "description": "Comes with the list"} for n in range(3)]
+            return user, body, None
+        if action == "ReadTask":
+            return user, None, {"listId": "1", "taskId": "1"}
+        if action in ("UpdateShare", "DeleteShare", "ReadShare"):
+            if not self.shares:
+                return None
+            list_id, shared_with = rng.choice(list(self.shares))
+            body = {"listId": list_id, "user": shared_with}
+            if action == "UpdateShare":
+                body["role"] = "viewer" if self.shares[(list_id, shared_with)] == "editor" else "editor"
+            return self.lists[list_id], body, None
+        if not owned:
+            return None
+        list_id = rng.choice(owned)
+        if action in ("ReadList", "ListShares"):
+            return user, None, {"listId": str(list_id)}
+        if action == "ListTasks":
+            query = {"listId": str(list_id), "limit": "50"} if rng.random() < 0.5 else {"listId": str(list_id)}
+            if rng.random() < 0.5:
+                query["fields"] = "summary"
+            return user, None, query
+        if action == "UpdateList":
+            return user, {"listId": list_id, "name": "Renamed", "description": "Updated by the load test"}, None
+        if action == "DeleteList":
+            empty = [candidate for candidate in owned if not self.tasks[candidate]]
+            return (user, {"listId": rng.choice(empty)}, None) if empty else None
+        if action == "CreateTask":
+            return user, {"listId": list_id, "name": "New task", "description": "Created by the load test"}, None
+        if action == "BatchCreateTasks":
+            tasks = [{"name": f"Imported {n}", "description": "Created in a batch"} for n in range(rng.randint(2, 60))]
+            return user, {"listId": list_id, "tasks": tasks}, None
+        if action in ("BatchUpdateTasks", "BatchDeleteTasks"):
+            if not self.tasks[list_id]:
+                return None
+            chosen = rng.sample(self.tasks[list_id], min(len(self.tasks[list_id]), rng.randint(1, 30)))
+            if action == "BatchDeleteTasks":
+                return user, {"listId": list_id, "taskIds": chosen}, None
+            tasks = [{"taskId": task_id, "name": "Updated in a batch", "description": ""} for task_id in chosen]
+            return user, {"listId": list_id, "tasks": tasks}, None
+        if action in ("UpdateTask", "DeleteTask"):
+            if not self.tasks[list_id]:
+                return None
+            body = {"listId": list_id, "taskId": rng.choice(self.tasks[list_id])}
+            if action == "UpdateTask":
+                body.update(name="Updated task", description="Updated by the load test")
+            return user, body, None
+        if action == "CreateShare":
+            candidates = [other for other in self.users if other != user and (list_id, other) not in self.shares]
+            if not candidates:
+                return None
+            return (
+                user,
+                {"listId": list_id, "user": rng.choice(candidates), "role": rng.choice(["editor", "viewer"])},
+                None,
+            )
+        raise ValueError(action)
+
+    def apply(self, action: str, user: str, body: dict, response: dict) -> None:
+        if response["statusCode"] != 200:
+            return
+        result = json.loads(decode_body(response))
+        if action == "CreateList":
+            self.lists[result["listId"]] = user
+            self.tasks[result["listId"]] = list(range(1, len(body.get("tasks", [])) + 1))
+        elif action == "DeleteList":
+            del self.lists[body["listId"]]
+        elif action == "CreateTask":
+            self.tasks[body["listId"]].append(result["taskId"])
+        elif action == "DeleteTask":
+            self.tasks[body["listId"]].remove(body["taskId"])
+        elif action == "BatchCreateTasks":
+            self.tasks[body["listId"]].extend(entry["taskId"] for entry in result["results"] if "error" not in entry)
+        elif action == "BatchDeleteTasks":
+            deleted = {entry["taskId"] for entry in result["results"] if "error" not in entry}
+            self.tasks[body["listId"]] = [task_id for task_id in self.tasks[body["listId"]] if task_id not in deleted]
+        elif action in ("CreateShare", "UpdateShare"):
+            self.shares[(body["listId"], body["user"])] = body["role"]
+        elif action == "DeleteShare":
+            del self.shares[(body["listId"], body["user"])]
+
+
+def decode_body(response: dict) -> str:
+    if not response.get("isBase64Encoded"):
+        return response["body"]
+    data = base64.b64decode(response["body"])
+    coding = response["headers"].get("Content-Encoding")
+    if coding == "gzip":
+        data = gzip.decompress(data)
+    elif coding == "deflate":
+        data = zlib.decompress(data)
+    return data.decode()
+
+
+def wire_bytes(response: dict) -> int:
+    # What API Gateway sends on: base64 bodies are decoded back to binary
+    body = response["body"]
+    return len(base64.b64decode(body)) if response.get("isBase64Encoded") else len(body.encode())
+
+
+def percentile(samples: list, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def run(args) -> dict:
+    rng = random.Random(args.seed)
+    calls = fakes.CallCounter()
+    table = fakes.FakeTable(calls=calls, latency=args.dynamodb_latency_ms / 1000, page_items=args.page_items)
+    avp = fakes.FakeVerifiedPermissions(calls=calls, latency=args.avp_latency_ms / 1000)
+    database.table = table
+    database.dynamodb = fakes.FakeDynamoDB(table)
+    permissions.avp = avp
+    permissions.LOCAL_AUTHORIZATION = args.local_authorization
+    permissions.SHARE_READS = args.share_reads
+
+    world = World(rng, args.users, args.lists_per_user, args.tasks_per_list, args.shares)
+    world.seed(table, avp)
+    tokens = {user: access_token(sub=user) for user in world.users}
+
+    actions = list(DEFAULT_MIX)
+    weights = [DEFAULT_MIX[action] for action in actions]
+    latencies = defaultdict(list)
+    downstream = defaultdict(Counter)
+    statuses = defaultdict(Counter)
+    sizes = defaultdict(list)
+    # Clients poll reads with the ETag of the last response they got, as a browser cache would
+    etags = {}
+
+    started = time.perf_counter()
+    completed = 0
+    while completed < args.requests:
+        action = rng.choices(actions, weights)[0]
+        request = world.request(action)
+        if request is None:
+            continue
+        user, body, query = request
+        resource, method = ROUTES[action]
+        cache_key = (user, resource, tuple(sorted((query or {}).items())))
+        headers = {"If-None-Match": etags[cache_key]} if method == "GET" and cache_key in etags else None
+        event = api_event(resource, method, body=body, query=query or None, token=tokens[user], headers=headers)
+
+        before = calls.snapshot()
+        start = time.perf_counter()
+        response = handler.handler(event, None)
+        latencies[action].append(time.perf_counter() - start)
+        downstream[action].update(calls.snapshot() - before)
+        statuses[action][response["statusCode"]] += 1
+        sizes[action].append(wire_bytes(response))
+        if "ETag" in response["headers"]:
+            etags[cache_key] = response["headers"]["ETag"]
+        world.apply(action, user, body, response)
+        completed += 1
+    elapsed = time.perf_counter() - started
+    # Shadow comparisons run in the background; let them finish before reading their counts
+    concurrency.pool.shutdown(wait=True)
+
+    report = {"requests": completed, "seconds": elapsed, "throughput": completed / elapsed, "actions": {}}
+    if args.local_authorization == "shadow":
+        report["shadow"] = dict(permissions.shadow_stats)
+    for action in actions:
+        samples = latencies.get(action)
+        if not samples:
+            continue
+        report["actions"][action] = {
+            "count": len(samples),
+            "p50_ms": percentile(samples, 0.5) * 1000,
+            "p99_ms": percentile(samples, 0.99) * 1000,
+            "mean_ms": statistics.fmean(samples) * 1000,
+            "mean_bytes": statistics.fmean(sizes[action]),
+            "calls_per_request": {op: count / len(samples) for op, count in sorted(downstream[action].items())},
+            "statuses": {str(status): count for status, count in statuses[action].items()},
+        }
+    return report
+
+
+def print_report(report: dict) -> None:
+    print(f"{report['requests']} requests in {report['seconds']:.2f}s ({report['throughput']:.1f} req/s)")
+    print(f"{'action':<16} {'n':>5} {'p50 ms':>8} {'p99 ms':>8} {'bytes':>7}  downstream calls per request")
+    for action, stats in report["actions"].items():
+        calls = ", ".join(f"{op}={count:.2f}" for op, count in stats["calls_per_request"].items())
+        print(
+            f"{action:<16} {stats['count']:>5} {stats['p50_ms']:>8.2f} {stats['p99_ms']:>8.2f} "
+            f"{stats['mean_bytes']:>7.0f}  {calls}"
+        )
+    if "shadow" in report:
+        print("shadow authorization: " + ", ".join(f"{outcome}={count}" for outcome, count in report["shadow"].items()))
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    regressions = []
+    for action, stats in report["actions"].items():
+        base = baseline["actions"].get(action)
+        if not base:
+            continue
+        if stats["p99_ms"] > base["p99_ms"] * (1 + tolerance) + 0.5:
+            regressions.append(f"{action}: p99 {base['p99_ms']:.2f} -> {stats['p99_ms']:.2f} ms")
+        calls, base_calls = sum(stats["calls_per_request"].values()), sum(base["calls_per_request"].values())
+        if calls > base_calls * (1 + tolerance) + 0.01:
+            regressions.append(f"{action}: downstream calls {base_calls:.2f} -> {calls:.2f} per request")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--lists-per-user", type=int, default=3)
+    parser.add_argument("--tasks-per-list", type=int, default=40)
+    parser.add_argument("--shares", type=int, default=100)
+    parser.add_argument("--page-items", type=int, default=1000, help="items per DynamoDB page (the 1 MB limit)")
+    parser.add_argument("--dynamodb-latency-ms", type=float, default=0.0)
+    parser.add_argument("--avp-latency-ms", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument(
+        "--local-authorization", choices=["off", "shadow", "on"], default=permissions.LOCAL_AUTHORIZATION
+    )
+    parser.add_argument("--share-reads", choices=["policies", "records"], default="records")
+    parser.add_argument("--save", help="write the report as JSON")
+    parser.add_argument("--compare", help="baseline JSON report to gate against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    if args.save:
+        with open(args.save, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(report, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
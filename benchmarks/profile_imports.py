@@ -0,0 +1,60 @@
+# Reports how long a cold start spends importing each module of the api_lambda handler, from a fresh interpreter
+# started with -X importtime, so regressions in cold-start cost show up as numbers.
+#
+#   python benchmarks/profile_imports.py
+#   python benchmarks/profile_imports.py --module permissions --top 40
+import argparse
+import os
+import subprocess
+import sys
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda_functions", "api_lambda")
+ENVIRONMENT = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "AWS_DATA_PATH": "./models",
+    "POLICY_STORE_ID": "ps-profile",
+    "TASK_LIST_EDITOR_TEMPLATE_ID": "editor-template",
+    "TASK_LIST_VIEWER_TEMPLATE_ID": "viewer-template",
+    "LOG_LEVEL": "OFF",
+}
+
+
+def import_times(module: str) -> list[tuple[str, float, float]]:
+    env = {**os.environ, **ENVIRONMENT}
+    env.pop("COGNITO_ISSUER", None)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=LAMBDA_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise SystemExit(proc.stderr)
+
+    # import time: self [us] | cumulative | imported package
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        rows.append((name.rstrip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="handler")
+    parser.add_argument("--top", type=int, default=25, help="slowest modules to list by self time")
+    args = parser.parse_args()
+
+    rows = import_times(args.module)
+    total = next(cumulative for name, _, cumulative in reversed(rows) if name.strip() == args.module)
+    print(f"import {args.module}: {total:.1f} ms across {len(rows)} modules\n")
+    print(f"{'self ms':>9} {'cumulative ms':>14}  module")
+    for name, self_ms, cumulative_ms in sorted(rows, key=lambda row: row[1], reverse=True)[: args.top]:
+        print(f"{self_ms:9.1f} {cumulative_ms:14.1f}  {name.strip()}")
+
+
+if __name__ == "__main__":
+    main()
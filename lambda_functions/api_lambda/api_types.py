@@ -1,8 +1,25 @@
 from dataclasses import dataclass
+from json.encoder import encode_basestring_ascii
+from typing import Optional
+import json
+
+# The models are slotted (no per-instance __dict__) and each writes its own JSON, so a response with thousands of
+# tasks is one string join instead of a dict per object built through a json.dumps default callback
+
+
+def quote(value: Optional[str]) -> str:
+    # Names and descriptions that were never given are stored as null, and written back as null
+    return "null" if value is None else encode_basestring_ascii(value)
+
+
+def string(attribute: dict) -> Optional[str]:
+    # A wire format string attribute, which is {"NULL": true} where the item holds null
+    return attribute.get("S")
 
 
 @dataclass
 class List:
+    __slots__ = ("id", "owner", "name", "description")
     id: int
     owner: str
     name: str
@@ -17,9 +34,26 @@ class List:
             description=item["description"],
         )
 
+    @classmethod
+    def from_attributes(cls, attributes):
+        # Decodes a low-level (wire format) item without going through Decimal
+        return List(
+            id=int(attributes["listId"]["N"]),
+            owner=attributes["owner"]["S"],
+            name=string(attributes["name"]),
+            description=string(attributes["description"]),
+        )
+
+    def to_json(self) -> str:
+        return (
+            f'{{"id":{self.id},"owner":{quote(self.owner)},"name":{quote(self.name)},'
+            f'"description":{quote(self.description)}}}'
+        )
+
 
 @dataclass
 class Task:
+    __slots__ = ("id", "name", "description")
     id: int
     name: str
     description: str
@@ -32,9 +66,58 @@ class Task:
             description=item["description"],
         )
 
+    @classmethod
+    def from_attributes(cls, attributes):
+        return Task(
+            id=int(attributes["taskId"]["N"]),
+            name=string(attributes["name"]),
+            description=string(attributes["description"]),
+        )
+
+    def to_json(self) -> str:
+        return f'{{"id":{self.id},"name":{quote(self.name)},"description":{quote(self.description)}}}'
+
+
+@dataclass
+class ListSummary:
+    # The compact shape for list views, without the description
+    __slots__ = ("id", "name")
+    id: int
+    name: str
+
+    @classmethod
+    def from_item(cls, item):
+        return ListSummary(id=int(item["listId"]), name=item["name"])
+
+    @classmethod
+    def from_attributes(cls, attributes):
+        return ListSummary(id=int(attributes["listId"]["N"]), name=string(attributes["name"]))
+
+    def to_json(self) -> str:
+        return f'{{"id":{self.id},"name":{quote(self.name)}}}'
+
+
+@dataclass
+class TaskSummary:
+    __slots__ = ("id", "name")
+    id: int
+    name: str
+
+    @classmethod
+    def from_item(cls, item):
+        return TaskSummary(id=int(item["taskId"]), name=item["name"])
+
+    @classmethod
+    def from_attributes(cls, attributes):
+        return TaskSummary(id=int(attributes["taskId"]["N"]), name=string(attributes["name"]))
+
+    def to_json(self) -> str:
+        return f'{{"id":{self.id},"name":{quote(self.name)}}}'
+
 
 @dataclass
 class Share:
+    __slots__ = ("user", "role")
     user: str
     role: str
 
@@ -45,11 +128,32 @@ class Share:
             role=item["role"],
         )
 
+    def to_json(self) -> str:
+        return f'{{"user":{quote(self.user)},"role":{quote(self.role)}}}'
+
 
 @dataclass
 class SharedList(List):
+    __slots__ = ("role",)
     role: str
 
     @classmethod
     def from_list(cls, list: List, role: str):
-        return SharedList(**list.__dict__, role=role)
+        return SharedList(id=list.id, owner=list.owner, name=list.name, description=list.description, role=role)
+
+    def to_json(self) -> str:
+        return (
+            f'{{"id":{self.id},"owner":{quote(self.owner)},"name":{quote(self.name)},'
+            f'"description":{quote(self.description)},"role":{quote(self.role)}}}'
+        )
+
+
+def to_json(value) -> str:
+    # Same output as json.dumps(value, separators=(",", ":")) with models written as objects of their fields
+    if isinstance(value, (List, Task, ListSummary, TaskSummary, Share)):
+        return value.to_json()
+    if isinstance(value, list):
+        return "[" + ",".join([to_json(member) for member in value]) + "]"
+    if isinstance(value, dict):
+        return "{" + ",".join([f"{quote(key)}:{to_json(member)}" for key, member in value.items()]) + "}"
+    return json.dumps(value, separators=(",", ":"))
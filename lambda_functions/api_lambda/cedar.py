@@ -0,0 +1,362 @@
+import re
+from typing import Optional
+
+# Parses and evaluates the part of Cedar that TinyTodo's policies are written in, so authorization decisions can be
+# made in process from a snapshot of the policy store:
+#
+#   permit | forbid (
+#       principal [== E | in E | is T],                 E may be ?principal in a template
+#       action [== A | in A | in [A, ...]],             `in` follows the action groups of the schema
+#       resource [== E | in E | is T [in E]]            E may be ?resource in a template
+#   ) [when | unless { a == b && c != d || ... }];      operands: variables, their attributes, entity/string/bool
+#
+# The API never sends parents for principals or lists, so `principal in E` and `resource in E` hold exactly when
+# the two are equal. Anything else raises Unsupported when parsed: a policy set this module cannot read is never
+# evaluated locally. Entities are (type, id) tuples, e.g. ("TinyTodo::User", "us-east-1_x|sub").
+
+TOKEN_RE = re.compile(
+    r"\s*(?:(?P<comment>//[^\n]*)"
+    r'|(?P<string>"(?:[^"\\]|\\.)*")'
+    r"|(?P<slot>\?principal|\?resource)"
+    r"|(?P<ident>[A-Za-z_][A-Za-z0-9_]*)"
+    r"|(?P<symbol>::|==|!=|&&|\|\||[()\[\]{},;.@!]))"
+)
+ESCAPES = {"n": "\n", "r": "\r", "t": "\t", "\\": "\\", "0": "\0", "'": "'", '"': '"'}
+
+
+class Unsupported(Exception):
+    pass
+
+
+class EvaluationError(Exception):
+    pass
+
+
+def tokenize(text: str) -> list[tuple[str, str]]:
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN_RE.match(text, position)
+        if match is None:
+            raise Unsupported(f"unexpected input at {text[position:position + 20]!r}")
+        kind = match.lastgroup
+        if kind != "comment":
+            tokens.append((kind, match.group(kind)))
+        position = match.end()
+    return tokens
+
+
+def unquote(literal: str) -> str:
+    return re.sub(r"\\(.)", lambda match: ESCAPES.get(match.group(1), match.group(0)), literal[1:-1])
+
+
+class Policy:
+    __slots__ = ("policy_id", "effect", "principal", "action", "resource", "conditions")
+
+    def __init__(self, policy_id, effect, principal, action, resource, conditions):
+        self.policy_id = policy_id
+        self.effect = effect
+        # Principal and resource scopes are (operator, entity or slot, `is` type) and the action scope is
+        # (operator, actions); a None operator or type matches anything
+        self.principal = principal
+        self.action = action
+        self.resource = resource
+        self.conditions = conditions
+
+
+class Parser:
+    def __init__(self, text: str):
+        self.tokens = tokenize(text)
+        self.position = 0
+
+    def peek(self) -> Optional[str]:
+        return self.tokens[self.position][1] if self.position < len(self.tokens) else None
+
+    def take(self, expected: Optional[str] = None) -> tuple[str, str]:
+        if self.position >= len(self.tokens):
+            raise Unsupported("unexpected end of policy")
+        token = self.tokens[self.position]
+        if expected is not None and token[1] != expected:
+            raise Unsupported(f"expected {expected!r}, found {token[1]!r}")
+        self.position += 1
+        return token
+
+    def accept(self, value: str) -> bool:
+        if self.peek() == value:
+            self.position += 1
+            return True
+        return False
+
+    def policies(self, policy_id: str) -> list[Policy]:
+        policies = []
+        while self.position < len(self.tokens):
+            policies.append(self.policy(policy_id))
+        return policies
+
+    def policy(self, policy_id: str) -> Policy:
+        while self.accept("@"):
+            self.take()
+            self.take("(")
+            self.take()
+            self.take(")")
+        effect = self.take()[1]
+        if effect not in ("permit", "forbid"):
+            raise Unsupported(f"unknown effect {effect!r}")
+        self.take("(")
+        self.take("principal")
+        principal = self.scope(("==", "in", "is"))
+        self.take(",")
+        self.take("action")
+        action = self.action_scope()
+        self.take(",")
+        self.take("resource")
+        resource = self.scope(("==", "in", "is"))
+        self.take(")")
+        conditions = []
+        while self.peek() in ("when", "unless"):
+            kind = self.take()[1]
+            self.take("{")
+            conditions.append((kind == "when", self.disjunction()))
+            self.take("}")
+        self.take(";")
+        return Policy(policy_id, effect, principal, action, resource, conditions)
+
+    def scope(self, operators: tuple) -> tuple:
+        operator = self.peek()
+        if operator not in operators:
+            return (None, None, None)
+        self.take()
+        if operator == "is":
+            entity_type = self.path()
+            if self.accept("in"):
+                return ("in", self.entity_or_slot(), entity_type)
+            return (None, None, entity_type)
+        return (operator, self.entity_or_slot(), None)
+
+    def action_scope(self) -> tuple:
+        if self.accept("=="):
+            return ("==", self.entity())
+        if not self.accept("in"):
+            return (None, None)
+        if not self.accept("["):
+            return ("in", (self.entity(),))
+        actions = [self.entity()]
+        while self.accept(","):
+            actions.append(self.entity())
+        self.take("]")
+        return ("in", tuple(actions))
+
+    def path(self) -> str:
+        kind, name = self.take()
+        if kind != "ident":
+            raise Unsupported(f"expected a name, found {name!r}")
+        parts = [name]
+        while (
+            self.peek() == "::"
+            and self.position + 1 < len(self.tokens)
+            and self.tokens[self.position + 1][0] == "ident"
+        ):
+            self.take()
+            parts.append(self.take()[1])
+        return "::".join(parts)
+
+    def entity(self) -> tuple:
+        entity_type = self.path()
+        self.take("::")
+        kind, literal = self.take()
+        if kind != "string":
+            raise Unsupported(f"expected an entity id, found {literal!r}")
+        return (entity_type, unquote(literal))
+
+    def entity_or_slot(self):
+        if self.position < len(self.tokens) and self.tokens[self.position][0] == "slot":
+            return self.take()[1]
+        return self.entity()
+
+    # Conditions compile to nested tuples: ("or", a, b), ("and", a, b), ("not", a), ("==", a, b), ("!=", a, b),
+    # ("var", name), ("attr", expression, name) and ("value", constant)
+    def disjunction(self) -> tuple:
+        expression = self.conjunction()
+        while self.accept("||"):
+            expression = ("or", expression, self.conjunction())
+        return expression
+
+    def conjunction(self) -> tuple:
+        expression = self.comparison()
+        while self.accept("&&"):
+            expression = ("and", expression, self.comparison())
+        return expression
+
+    def comparison(self) -> tuple:
+        left = self.unary()
+        if self.peek() in ("==", "!="):
+            operator = self.take()[1]
+            return (operator, left, self.unary())
+        return left
+
+    def unary(self) -> tuple:
+        # As in Cedar, ! binds tighter than == and !=: !a == b is (!a) == b
+        if self.accept("!"):
+            return ("not", self.unary())
+        return self.operand()
+
+    def operand(self) -> tuple:
+        if self.accept("("):
+            expression = self.disjunction()
+            self.take(")")
+            return expression
+        kind, value = self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+        if kind == "string":
+            self.take()
+            expression = ("value", unquote(value))
+        elif value in ("true", "false"):
+            self.take()
+            expression = ("value", value == "true")
+        elif value in ("principal", "action", "resource", "context"):
+            self.take()
+            expression = ("var", value)
+        elif kind == "ident":
+            expression = ("value", self.entity())
+        else:
+            raise Unsupported(f"unsupported expression at {value!r}")
+        while self.accept("."):
+            kind, name = self.take()
+            if kind != "ident" or self.peek() == "(":
+                raise Unsupported("method calls are not supported")
+            expression = ("attr", expression, name)
+        return expression
+
+
+def parse(text: str, policy_id: str = "") -> list[Policy]:
+    return Parser(text).policies(policy_id)
+
+
+def action_ancestors(schema: dict) -> dict[tuple, frozenset]:
+    # Every action of a Cedar JSON schema, mapped to the transitive closure of its action groups
+    parents = {}
+    for namespace, definition in schema.items():
+        action_type = f"{namespace}::Action" if namespace else "Action"
+        for name, action in definition.get("actions", {}).items():
+            parents[(action_type, name)] = [
+                (group.get("type", action_type), group["id"]) for group in action.get("memberOf") or []
+            ]
+
+    ancestors = {}
+
+    def closure(action: tuple, seen: frozenset) -> frozenset:
+        if action not in ancestors:
+            found = set()
+            for parent in parents.get(action, []):
+                if parent not in seen:
+                    found.add(parent)
+                    found |= closure(parent, seen | {parent})
+            ancestors[action] = frozenset(found)
+        return ancestors[action]
+
+    for action in parents:
+        closure(action, frozenset([action]))
+    return ancestors
+
+
+class Request:
+    __slots__ = ("principal", "action", "resource", "entities", "action_ancestors")
+
+    def __init__(self, principal: tuple, action: tuple, resource: tuple, entities: dict, ancestors: dict):
+        self.principal = principal
+        self.action = action
+        self.resource = resource
+        # entity -> {attribute: value}
+        self.entities = entities
+        self.action_ancestors = ancestors.get(action, frozenset())
+
+
+def matches(policy: Policy, request: Request, slots: Optional[dict] = None) -> bool:
+    operator, operand, entity_type = policy.principal
+    if entity_type is not None and request.principal[0] != entity_type:
+        return False
+    if operator is not None and request.principal != (slots[operand] if isinstance(operand, str) else operand):
+        return False
+
+    operator, operand = policy.action
+    if operator == "==" and request.action != operand:
+        return False
+    if operator == "in" and not any(a == request.action or a in request.action_ancestors for a in operand):
+        return False
+
+    operator, operand, entity_type = policy.resource
+    if entity_type is not None and request.resource[0] != entity_type:
+        return False
+    if operator is not None and request.resource != (slots[operand] if isinstance(operand, str) else operand):
+        return False
+
+    try:
+        return all(evaluate(expression, request) is when for when, expression in policy.conditions)
+    except EvaluationError:
+        # As in Cedar, a policy whose condition fails to evaluate is ignored
+        return False
+
+
+def granted_actions(policies: list[Policy], ancestors: dict) -> Optional[frozenset]:
+    # The actions a template grants, compiled to a set, when the template is nothing but a permit of some actions
+    # for ?principal on ?resource. Links of such a template reduce to a lookup of the request's action.
+    if len(policies) != 1:
+        return None
+    policy = policies[0]
+    operator, actions = policy.action
+    if (
+        policy.effect != "permit"
+        or policy.conditions
+        or operator is None
+        or policy.principal != ("==", "?principal", None)
+        or policy.resource != ("==", "?resource", None)
+    ):
+        return None
+    if operator == "==":
+        return frozenset([actions])
+    listed = set(actions)
+    return frozenset(listed | {action for action, groups in ancestors.items() if groups & listed})
+
+
+def is_authorized(policies: list[tuple[Policy, Optional[dict]]], request: Request, permitted: bool = False) -> bool:
+    # (policy, slot values) pairs; a matching forbid overrides every permit, and nothing matching means deny.
+    # `permitted` says whether a permit outside `policies` already applies.
+    for policy, slots in policies:
+        if matches(policy, request, slots):
+            if policy.effect == "forbid":
+                return False
+            permitted = True
+    return permitted
+
+
+def evaluate(expression: tuple, request: Request):
+    kind = expression[0]
+    if kind == "value":
+        return expression[1]
+    if kind == "var":
+        if expression[1] == "context":
+            return {}
+        return getattr(request, expression[1])
+    if kind == "attr":
+        target = evaluate(expression[1], request)
+        attributes = target if isinstance(target, dict) else request.entities.get(target, {})
+        if expression[2] not in attributes:
+            raise EvaluationError(f"no attribute {expression[2]}")
+        return attributes[expression[2]]
+    if kind == "==":
+        return evaluate(expression[1], request) == evaluate(expression[2], request)
+    if kind == "!=":
+        return evaluate(expression[1], request) != evaluate(expression[2], request)
+    if kind == "not":
+        return not boolean(evaluate(expression[1], request))
+    if kind == "and":
+        return boolean(evaluate(expression[1], request)) and boolean(evaluate(expression[2], request))
+    if kind == "or":
+        return boolean(evaluate(expression[1], request)) or boolean(evaluate(expression[2], request))
+    raise EvaluationError(f"unknown expression {kind}")
+
+
+def boolean(value) -> bool:
+    if not isinstance(value, bool):
+        raise EvaluationError("expected a boolean")
+    return value
@@ -0,0 +1,38 @@
+import threading
+
+# AWS clients are created on first use rather than at import, all from one botocore session, so a cold start only
+# pays for the clients the first request actually needs. botocore is used directly: importing boto3 drags in
+# s3transfer and the resource layer, which this function never uses.
+_lock = threading.Lock()
+_session = None
+_clients = {}
+
+
+def session():
+    global _session
+    with _lock:
+        if _session is None:
+            import botocore.session
+
+            _session = botocore.session.get_session()
+        return _session
+
+
+def client(service_name: str):
+    found = _clients.get(service_name)
+    if found is None:
+        aws_session = session()
+        with _lock:
+            found = _clients.get(service_name)
+            if found is None:
+                found = _clients[service_name] = aws_session.create_client(service_name)
+    return found
+
+
+class LazyClient:
+    # Stands in for a botocore client at module level and creates the real one on the first API call
+    def __init__(self, service_name: str):
+        self.service_name = service_name
+
+    def __getattr__(self, name: str):
+        return getattr(client(self.service_name), name)
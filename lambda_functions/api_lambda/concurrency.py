@@ -0,0 +1,32 @@
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable
+
+# One pool per container, shared by every invocation. botocore clients are thread-safe, so DynamoDB and Verified
+# Permissions calls that do not depend on each other can be in flight at the same time. Tasks running on the pool
+# must never block on other pool tasks, or a busy pool could deadlock.
+worker = threading.local()
+pool = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("FANOUT_WORKERS", "8")),
+    thread_name_prefix="fanout",
+    initializer=lambda: setattr(worker, "pooled", True),
+)
+
+
+def submit(fn: Callable, *args, **kwargs) -> Future:
+    return pool.submit(fn, *args, **kwargs)
+
+
+def completed(value) -> Future:
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def map_ordered(fn: Callable, items: Iterable) -> list:
+    items = list(items)
+    # On a pool thread (e.g. a speculative handler) the items are mapped inline rather than waited on
+    if len(items) <= 1 or getattr(worker, "pooled", False):
+        return [fn(item) for item in items]
+    return list(pool.map(fn, items))
@@ -1,23 +1,143 @@
 from decimal import Decimal
-from typing import Optional
+from typing import Callable, Iterator, Optional
+import base64
+import binascii
+import functools
+import json
+import os
+import random
+import time
+
+import concurrency
+import dynamo
+import ids
+from api_types import List, ListSummary, Share, Task, TaskSummary
+from cache import TTLCache
 
-import boto3
-from boto3.dynamodb.conditions import Key
 
-from api_types import List, Task
+class ShareExists(Exception):
+    pass
 
 
-class ShareExists(Exception):
+class UnknownField(Exception):
     pass
 
 
-dynamodb = boto3.resource("dynamodb")
+dynamodb = dynamo.DynamoDB()
 table = dynamodb.Table("TinyTodoTable")
 OWNER_LIST_ID_INDEX = "OwnerListIdIndex"
 
+# Reads of lists and tasks skip the generic attribute marshalling and decode the wire format straight into
+# List/Task, avoiding a Decimal for every number only to turn it back into an int
+FAST_DECODE = os.environ.get("DYNAMODB_FAST_DECODE", "true").lower() == "true"
+decode_list = List.from_attributes if FAST_DECODE else List.from_item
+decode_task = Task.from_attributes if FAST_DECODE else Task.from_item
+
+USER_BY_NAME = dynamo.QueryTemplate("pk")
+LISTS_BY_OWNER = dynamo.QueryTemplate("owner", index_name=OWNER_LIST_ID_INDEX)
+TASKS_BY_LIST = dynamo.QueryTemplate("pk", sort_prefix="TASK#")
+SHARES_BY_LIST = dynamo.QueryTemplate("pk", sort_prefix="SHARE#")
+SHARES_BY_USER = dynamo.QueryTemplate("pk")
+DETAILS_SK = {"S": "DETAILS"}
+
+# The list endpoints can return some fields of each list or task only (e.g. fields=id,name). The query then projects
+# the items onto the matching attributes, so long descriptions and bookkeeping attributes such as nextTaskId never
+# leave DynamoDB. Selecting exactly SUMMARY_FIELDS returns the ListSummary / TaskSummary models.
+LIST_ATTRIBUTES = {"id": "listId", "owner": "owner", "name": "name", "description": "description"}
+TASK_ATTRIBUTES = {"id": "taskId", "name": "name", "description": "description"}
+SUMMARY_FIELDS = ("id", "name")
+
+# BatchGetItem accepts at most 100 keys per call and may hand back part of them as UnprocessedKeys when the
+# table is throttled. Those are retried with exponential backoff and jitter.
+BATCH_GET_LIMIT = 100
+BATCH_MAX_RETRIES = 8
+BATCH_BACKOFF_BASE = 0.05
+BATCH_BACKOFF_CAP = 2.0
+TRANSACT_WRITE_LIMIT = 100
+# Tasks per transaction, leaving room for the taskCount update
+TASK_CHUNK = TRANSACT_WRITE_LIMIT - 1
+# Tasks that can be created with a new list, or created, updated or deleted in one batch request
+MAX_BATCH_TASKS = 1000
+
+
+# Cursor pagination for the list endpoints: `limit` is capped so one page always fits comfortably in memory
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+# The key attributes of the last item of a page, which its nextToken encodes, with the prefix each string attribute
+# starts with (None for numbers). Lists are paged on the owner index, whose keys come with the table's.
+LIST_PAGE_KEY = {"pk": "LIST#", "sk": "DETAILS", "owner": "", "listId": None}
+TASK_PAGE_KEY = {"pk": "LIST#", "sk": "TASK#"}
+
+
+# Username -> "pool|sub" never changes once Cognito has confirmed the user, so hits are kept for a long time.
+# Misses are only kept briefly so that a user who signs up right after a failed share can be found.
+user_key_cache = TTLCache(
+    maxsize=int(os.environ.get("USER_KEY_CACHE_SIZE", "4096")),
+    ttl=float(os.environ.get("USER_KEY_CACHE_TTL", "86400")),
+)
+USER_KEY_MISS_TTL = float(os.environ.get("USER_KEY_MISS_TTL", "30"))
+
+# List IDs come from blocks leased from the GLOBAL nextListId counter ("counter"), from blocks leased from
+# LIST_ID_SHARDS counters on separate partitions ("sharded"), or are time-sortable IDs built on the counter ("time").
+# All containers of this function and of the Cognito post-confirmation function must run the same strategy, and a
+# table must not go back to "counter" once it has used another.
+LIST_ID_STRATEGY = os.environ.get("LIST_ID_STRATEGY", "counter").lower()
+LIST_ID_SHARDS = int(os.environ.get("LIST_ID_SHARDS", "8"))
+LIST_ID_BLOCK_MIN = int(os.environ.get("LIST_ID_BLOCK_MIN", "10"))
+LIST_ID_BLOCK_MAX = int(os.environ.get("LIST_ID_BLOCK_MAX", "1000"))
+ID_LEASE_INTERVAL = float(os.environ.get("ID_LEASE_INTERVAL", "10"))
+# Task IDs stay per list, leased from the list's nextTaskId, with one allocator per recently used list
+TASK_ID_BLOCK_MIN = int(os.environ.get("TASK_ID_BLOCK_MIN", "5"))
+TASK_ID_BLOCK_MAX = int(os.environ.get("TASK_ID_BLOCK_MAX", "100"))
+task_id_allocators = TTLCache(maxsize=int(os.environ.get("TASK_ID_ALLOCATORS", "1024")), ttl=3600)
+
+
+class BatchIncomplete(Exception):
+    pass
+
+
+class InvalidPageToken(Exception):
+    pass
+
+
+class ListNotEmpty(Exception):
+    pass
+
+
+class TransactionCancelled(Exception):
+    def __init__(self, reasons: list[str]):
+        super().__init__(", ".join(reasons))
+        # One cancellation reason code per action, in request order ("None" for actions that were fine)
+        self.reasons = reasons
+
 
 def query_user_key(user_name: str) -> str:
-    items = table.query(KeyConditionExpression=Key("pk").eq(user_name))["Items"]
+    user_key = user_key_cache.get(user_name)
+    if user_key is None:
+        user_key = fetch_user_key(user_name)
+        user_key_cache.put(user_name, user_key, ttl=USER_KEY_MISS_TTL if user_key == "" else None)
+    return user_key
+
+
+def query_user_keys(user_names: list[str]) -> dict[str, str]:
+    # Batch variant of query_user_key: each name is resolved once, cached names without a query and the others
+    # concurrently
+    keys = {}
+    misses = []
+    for user_name in dict.fromkeys(user_names):
+        user_key = user_key_cache.get(user_name)
+        if user_key is None:
+            misses.append(user_name)
+        else:
+            keys[user_name] = user_key
+    for user_name, user_key in zip(misses, concurrency.map_ordered(fetch_user_key, misses)):
+        user_key_cache.put(user_name, user_key, ttl=USER_KEY_MISS_TTL if user_key == "" else None)
+        keys[user_name] = user_key
+    return {user_name: keys[user_name] for user_name in dict.fromkeys(user_names)}
+
+
+def fetch_user_key(user_name: str) -> str:
+    items = table.query(Limit=1, **USER_BY_NAME.arguments(user_name))["Items"]
 
     if len(items) == 0:
         return ""
@@ -33,56 +153,325 @@ def task_key(task_id: int) -> str:
     return f"TASK#{task_id:06}"
 
 
-def count_lists(user: str) -> int:
-    return table.query(
-        IndexName=OWNER_LIST_ID_INDEX,
-        KeyConditionExpression=Key("owner").eq(user),
-        Select="COUNT",
-    )["Count"]
+def encode_page_token(last_evaluated_key: dict) -> str:
+    data = json.dumps(last_evaluated_key, default=int, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode()
 
 
-def list_lists(user: str) -> list[List]:
-    items = table.query(
-        IndexName=OWNER_LIST_ID_INDEX,
-        KeyConditionExpression=Key("owner").eq(user),
-    )["Items"]
+def decode_page_token(token: str, attributes: dict, **expected) -> dict:
+    try:
+        key = json.loads(base64.urlsafe_b64decode(token.encode()), parse_int=Decimal)
+    except (ValueError, binascii.Error):
+        raise InvalidPageToken(token)
+
+    # The token comes from the client, so make sure it is a key of the query's items (which DynamoDB would otherwise
+    # reject) and cannot start the query in somebody else's partition
+    if not isinstance(key, dict) or set(key) != set(attributes):
+        raise InvalidPageToken(token)
+    for name, prefix in attributes.items():
+        value = key[name]
+        if not (isinstance(value, Decimal) if prefix is None else isinstance(value, str) and value.startswith(prefix)):
+            raise InvalidPageToken(token)
+    if any(key[name] != value for name, value in expected.items()):
+        raise InvalidPageToken(token)
+    return key
+
+
+def decode_value(value):
+    if FAST_DECODE:
+        ((kind, value),) = value.items()
+        if kind == "NULL":
+            # A name or description stored as null, which comes back as {"NULL": true}
+            return None
+        return int(value) if kind == "N" else value
+    return int(value) if isinstance(value, Decimal) else value
+
+
+@functools.lru_cache(maxsize=64)
+def selection(kind: str, fields: Optional[tuple[str, ...]]) -> tuple[dict, Callable[[dict], object]]:
+    # The query arguments that project list or task items onto `fields` (all fields when None) and the decoder for
+    # the items that come back. Fields are returned in their usual order whatever order they were asked for in.
+    attributes, model, summary = {
+        "list": (LIST_ATTRIBUTES, decode_list, ListSummary),
+        "task": (TASK_ATTRIBUTES, decode_task, TaskSummary),
+    }[kind]
+    if fields is None:
+        return {}, model
+
+    unknown = [field for field in fields if field not in attributes]
+    if unknown or not fields:
+        raise UnknownField(", ".join(unknown))
+    fields = tuple(field for field in attributes if field in fields)
+    names = {f"#{field}": attributes[field] for field in fields}
+    projection = {"ProjectionExpression": ", ".join(names), "ExpressionAttributeNames": names}
+    if fields == SUMMARY_FIELDS:
+        return projection, summary.from_attributes if FAST_DECODE else summary.from_item
+    return projection, lambda item: {field: decode_value(item[attributes[field]]) for field in fields}
+
+
+def projected(arguments: dict, projection: dict) -> dict:
+    if not projection:
+        return arguments
+    names = {**arguments["ExpressionAttributeNames"], **projection["ExpressionAttributeNames"]}
+    return {**arguments, **projection, "ExpressionAttributeNames": names}
+
+
+def query_items(**kwargs) -> Iterator[dict]:
+    while True:
+        resp = table.query(**kwargs)
+        yield from resp["Items"]
+        if "LastEvaluatedKey" not in resp:
+            return
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def query_count(**kwargs) -> int:
+    count = 0
+    while True:
+        resp = table.query(Select="COUNT", **kwargs)
+        count += resp["Count"]
+        if "LastEvaluatedKey" not in resp:
+            return count
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def query_page(
+    limit: int, next_token: Optional[str], attributes: dict, expected: dict, **kwargs
+) -> tuple[list[dict], Optional[str]]:
+    if next_token:
+        kwargs["ExclusiveStartKey"] = decode_page_token(next_token, attributes, **expected)
+
+    items = []
+    while True:
+        resp = table.query(Limit=limit - len(items), **kwargs)
+        items.extend(resp["Items"])
+        if "LastEvaluatedKey" not in resp:
+            return items, None
+        if len(items) >= limit:
+            return items, encode_page_token(resp["LastEvaluatedKey"])
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def details_key(list_id: int) -> dict:
+    if FAST_DECODE:
+        return {"pk": {"S": list_key(list_id)}, "sk": DETAILS_SK}
+    return {"pk": list_key(list_id), "sk": "DETAILS"}
+
+
+def lease_counter(key: dict, attribute: str, count: int, floor: int = 1, condition: Optional[str] = None) -> range:
+    # The counter holds the next unused ID; a missing counter starts at `floor`
+    kwargs = {"ConditionExpression": condition} if condition else {}
+    attributes = table.update_item(
+        Key=key,
+        UpdateExpression="SET #counter = if_not_exists(#counter, :floor) + :count",
+        ExpressionAttributeNames={"#counter": attribute},
+        ExpressionAttributeValues={":floor": Decimal(floor), ":count": Decimal(count)},
+        ReturnValues="UPDATED_NEW",
+        **kwargs,
+    )["Attributes"]
+    end = int(attributes[attribute])
+    return range(end - count, end)
 
-    return [List.from_item(item) for item in items]
 
+def lease_list_ids(count: int) -> range:
+    return lease_counter({"pk": "GLOBAL", "sk": "GLOBAL"}, "nextListId", count)
 
-def create_list(user: str, name: str, description: str) -> int:
-    attributes = table.update_item(
-        Key={"pk": "GLOBAL", "sk": "GLOBAL"},
-        UpdateExpression="ADD nextListId :one",
-        ExpressionAttributeValues={":one": Decimal("1")},
-        ReturnValues="UPDATED_OLD",
-    )["Attributes"]
 
-    list_id = int(attributes["nextListId"])
-
-    table.put_item(
-        Item={
-            "pk": list_key(list_id),
-            "sk": "DETAILS",
-            "name": name,
-            "description": description,
-            "listId": Decimal(list_id),
-            "owner": user,
-            "nextTaskId": Decimal(1),
-        }
+def lease_list_ids_from_shard(shard: int, count: int) -> range:
+    return lease_counter({"pk": f"GLOBAL#{shard}", "sk": "GLOBAL"}, "nextListId", count, floor=shard_floor())
+
+
+@functools.lru_cache(maxsize=None)
+def shard_floor() -> int:
+    # New shard counters start above every ID the single counter has handed out
+    item = table.get_item(Key={"pk": "GLOBAL", "sk": "GLOBAL"}, ConsistentRead=True).get("Item", {})
+    return -(-int(item.get("nextListId", 1)) // LIST_ID_SHARDS)
+
+
+def make_list_id_allocator():
+    if LIST_ID_STRATEGY == "sharded":
+        lease = ids.sharded(lease_list_ids_from_shard, LIST_ID_SHARDS)
+    else:
+        lease = lease_list_ids
+    allocator = ids.BlockAllocator(lease, LIST_ID_BLOCK_MIN, LIST_ID_BLOCK_MAX, ID_LEASE_INTERVAL)
+    return ids.TimeSortableAllocator(allocator) if LIST_ID_STRATEGY == "time" else allocator
+
+
+list_id_allocator = make_list_id_allocator()
+
+
+def task_id_allocator(list_id: int) -> ids.BlockAllocator:
+    def lease(count: int) -> range:
+        key = {"pk": list_key(list_id), "sk": "DETAILS"}
+        return lease_counter(key, "nextTaskId", count, condition="attribute_exists(pk)")
+
+    return task_id_allocators.get_or_load(
+        list_id, lambda: ids.BlockAllocator(lease, TASK_ID_BLOCK_MIN, TASK_ID_BLOCK_MAX, ID_LEASE_INTERVAL)
     )
 
+
+def count_lists(user: str) -> int:
+    return query_count(**LISTS_BY_OWNER.arguments(user))
+
+
+def list_lists(user: str, fields: Optional[tuple[str, ...]] = None) -> Iterator[object]:
+    projection, decode = selection("list", fields)
+    for item in query_items(raw=FAST_DECODE, **projected(LISTS_BY_OWNER.arguments(user, FAST_DECODE), projection)):
+        yield decode(item)
+
+
+def list_lists_page(
+    user: str, limit: int, next_token: Optional[str], fields: Optional[tuple[str, ...]] = None
+) -> tuple[list, Optional[str]]:
+    projection, decode = selection("list", fields)
+    items, next_token = query_page(
+        limit,
+        next_token,
+        LIST_PAGE_KEY,
+        {"owner": user},
+        raw=FAST_DECODE,
+        **projected(LISTS_BY_OWNER.arguments(user, FAST_DECODE), projection),
+    )
+    return [decode(item) for item in items], next_token
+
+
+def create_list(user: str, name: str, description: str, tasks: Optional[list[dict]] = None) -> int:
+    # The list and its first tasks are written together; task IDs of a new list are simply 1..n
+    list_id = list_id_allocator.allocate()
+    tasks = tasks or []
+    task_items = [
+        task_item(list_id, task_id, task["name"], task.get("description")) for task_id, task in enumerate(tasks, 1)
+    ]
+    first, rest = task_items[:TASK_CHUNK], task_items[TASK_CHUNK:]
+    details = {
+        "pk": list_key(list_id),
+        "sk": "DETAILS",
+        "name": name,
+        "description": description,
+        "listId": Decimal(list_id),
+        "owner": user,
+        "nextTaskId": Decimal(len(tasks) + 1),
+        "taskCount": Decimal(len(first)),
+    }
+    if first:
+        transact_write([put_new(details)] + [put_new(item) for item in first])
+    else:
+        table.put_item(Item=details, ConditionExpression="attribute_not_exists(pk)")
+    # Tasks past the first transaction are added like a batch create, once the list exists
+    for chunk in chunked(rest, TASK_CHUNK):
+        put_tasks(list_id, chunk)
+
     return list_id
 
 
+def task_item(list_id: int, task_id: int, name: str, description: Optional[str]) -> dict:
+    # A description that was not given is stored as null, as CreateTask always has
+    return {
+        "pk": list_key(list_id),
+        "sk": task_key(task_id),
+        "name": name,
+        "description": description,
+        "listId": Decimal(list_id),
+        "taskId": Decimal(task_id),
+    }
+
+
+def put_new(item: dict) -> dict:
+    return {"Put": {"TableName": table.name, "Item": item, "ConditionExpression": "attribute_not_exists(pk)"}}
+
+
+def count_tasks_by(list_id: int, delta: int, counted: bool = True) -> dict:
+    # Every write that adds or removes tasks moves the list's taskCount in the same transaction. Lists written before
+    # taskCount existed have none until tools/backfill_task_counts.py has run, and a count started there from zero
+    # would be wrong; writes to them bump taskWrites instead, so the backfill and delete_list can tell that the tasks
+    # changed while they were counting them.
+    if counted:
+        update, condition, values = "ADD taskCount :delta", "attribute_exists(taskCount)", {":delta": Decimal(delta)}
+    else:
+        update, condition = "ADD taskWrites :one", "attribute_exists(pk) AND attribute_not_exists(taskCount)"
+        values = {":one": Decimal(1)}
+    return {
+        "Update": {
+            "TableName": table.name,
+            "Key": {"pk": list_key(list_id), "sk": "DETAILS"},
+            "UpdateExpression": update,
+            "ConditionExpression": condition,
+            "ExpressionAttributeValues": values,
+        }
+    }
+
+
+def write_tasks(list_id: int, actions: list[dict], delta: int) -> None:
+    # The task writes of one transaction plus the count update; a list without taskCount only takes the second try
+    try:
+        transact_write(actions + [count_tasks_by(list_id, delta)])
+    except TransactionCancelled as e:
+        if e.reasons[-1:] != ["ConditionalCheckFailed"] or "ConditionalCheckFailed" in e.reasons[:-1]:
+            raise
+        transact_write(actions + [count_tasks_by(list_id, delta, counted=False)])
+
+
+def put_tasks(list_id: int, items: list[dict]) -> None:
+    write_tasks(list_id, [put_new(item) for item in items], len(items))
+
+
+def transact_write(actions: list[dict]) -> None:
+    # Writes that only lost a race for the same items (e.g. two creates bumping one list's taskCount) are retried
+    from botocore.exceptions import ClientError
+
+    for attempt in range(BATCH_MAX_RETRIES + 1):
+        try:
+            dynamodb.transact_write_items(TransactItems=actions)
+            return
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "TransactionCanceledException":
+                raise
+            reasons = [reason.get("Code", "None") for reason in e.response.get("CancellationReasons", [])]
+            if "TransactionConflict" not in reasons or "ConditionalCheckFailed" in reasons:
+                raise TransactionCancelled(reasons)
+        time.sleep(random.uniform(0, min(BATCH_BACKOFF_CAP, BATCH_BACKOFF_BASE * 2**attempt)))
+    raise TransactionCancelled(["TransactionConflict"])
+
+
 def get_list(list_id: int) -> Optional[List]:
     try:
-        item = table.get_item(Key={"pk": list_key(list_id), "sk": "DETAILS"})["Item"]
-        return List.from_item(item)
+        item = table.get_item(Key=details_key(list_id), raw=FAST_DECODE)["Item"]
+        return decode_list(item)
     except KeyError:
         return None
 
 
+def get_lists(list_ids: list[int]) -> list[Optional[List]]:
+    # BatchGetItem rejects duplicate keys, so each list is requested once and fanned back out in input order
+    unique_ids = list(dict.fromkeys(list_ids))
+    chunks = [
+        [details_key(list_id) for list_id in unique_ids[start : start + BATCH_GET_LIMIT]]
+        for start in range(0, len(unique_ids), BATCH_GET_LIMIT)
+    ]
+    lists = {}
+    for items in concurrency.map_ordered(batch_get_items, chunks):
+        for item in items:
+            task_list = decode_list(item)
+            lists[task_list.id] = task_list
+
+    return [lists.get(list_id) for list_id in list_ids]
+
+
+def batch_get_items(keys: list[dict]) -> list[dict]:
+    items = []
+    request = {table.name: {"Keys": keys}}
+    for attempt in range(BATCH_MAX_RETRIES + 1):
+        resp = dynamodb.batch_get_item(RequestItems=request, raw=FAST_DECODE)
+        items.extend(resp["Responses"].get(table.name, []))
+        request = resp.get("UnprocessedKeys")
+        if not request:
+            return items
+        time.sleep(random.uniform(0, min(BATCH_BACKOFF_CAP, BATCH_BACKOFF_BASE * 2**attempt)))
+
+    unprocessed = len(request[table.name]["Keys"])
+    raise BatchIncomplete(f"{unprocessed} keys still unprocessed after {BATCH_MAX_RETRIES} retries")
+
+
 def update_list(list_id: int, name: str, description: str) -> None:
     table.update_item(
         Key={"pk": list_key(list_id), "sk": "DETAILS"},
@@ -94,57 +483,246 @@ def update_list(list_id: int, name: str, description: str) -> None:
 
 
 def delete_list(list_id: int) -> None:
-    table.delete_item(Key={"pk": list_key(list_id), "sk": "DETAILS"})
-
-
-def count_tasks(list_id: int) -> int:
-    return table.query(
-        KeyConditionExpression=Key("pk").eq(list_key(list_id)) & Key("sk").begins_with("TASK#"),
-        Select="COUNT",
-    )["Count"]
+    # taskCount makes the emptiness check part of the delete itself. Lists written before taskCount existed
+    # (until tools/backfill_task_counts.py has run) fall back to counting their tasks; task writes never start a
+    # taskCount on them (see count_tasks_by).
+    from botocore.exceptions import ClientError
 
+    key = {"pk": list_key(list_id), "sk": "DETAILS"}
+    try:
+        table.delete_item(Key=key, ConditionExpression="taskCount = :zero", ExpressionAttributeValues={":zero": 0})
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            raise
+        item = table.get_item(Key=key, ConsistentRead=True).get("Item")
+        if item is None:
+            return
+        if "taskCount" in item or count_tasks(list_id) > 0:
+            raise ListNotEmpty(list_id)
+        # Task writes to a list without taskCount bump taskWrites, so the delete only goes through if there were none
+        # since the item was read
+        if "taskWrites" in item:
+            unchanged = {
+                "ConditionExpression": "taskWrites = :seen",
+                "ExpressionAttributeValues": {":seen": item["taskWrites"]},
+            }
+        else:
+            unchanged = {"ConditionExpression": "attribute_not_exists(taskWrites)"}
+        try:
+            table.delete_item(Key=key, **unchanged)
+        except ClientError as e:
+            # A task was created since the count
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                raise ListNotEmpty(list_id)
+            raise
+    task_id_allocators.invalidate(list_id)
 
-def list_tasks(list_id: int) -> list[Task]:
-    items = table.query(
-        KeyConditionExpression=Key("pk").eq(list_key(list_id)) & Key("sk").begins_with("TASK#"),
-    )["Items"]
 
-    return [Task.from_item(item) for item in items]
+def count_tasks(list_id: int) -> int:
+    return query_count(**TASKS_BY_LIST.arguments(list_key(list_id)))
+
+
+def list_tasks(list_id: int, fields: Optional[tuple[str, ...]] = None) -> Iterator[object]:
+    projection, decode = selection("task", fields)
+    arguments = projected(TASKS_BY_LIST.arguments(list_key(list_id), FAST_DECODE), projection)
+    for item in query_items(raw=FAST_DECODE, **arguments):
+        yield decode(item)
+
+
+def list_tasks_page(
+    list_id: int, limit: int, next_token: Optional[str], fields: Optional[tuple[str, ...]] = None
+) -> tuple[list, Optional[str]]:
+    projection, decode = selection("task", fields)
+    items, next_token = query_page(
+        limit,
+        next_token,
+        TASK_PAGE_KEY,
+        {"pk": list_key(list_id)},
+        raw=FAST_DECODE,
+        **projected(TASKS_BY_LIST.arguments(list_key(list_id), FAST_DECODE), projection),
+    )
+    return [decode(item) for item in items], next_token
 
 
 def create_task(list_id: int, name: str, description: str) -> int:
-    attributes = table.update_item(
-        Key={"pk": list_key(list_id), "sk": "DETAILS"},
-        UpdateExpression="ADD nextTaskId :one",
-        ExpressionAttributeValues={":one": Decimal("1")},
-        ReturnValues="UPDATED_OLD",
-    )["Attributes"]
-
-    task_id = int(attributes["nextTaskId"])
-
-    table.put_item(
-        Item={
-            "pk": list_key(list_id),
-            "sk": task_key(task_id),
-            "name": name,
-            "description": description,
-            "listId": Decimal(list_id),
-            "taskId": Decimal(task_id),
-        }
-    )
-
+    task_id = task_id_allocator(list_id).allocate()
+    put_tasks(list_id, [task_item(list_id, task_id, name, description)])
     return task_id
 
 
-def update_task(list_id: int, task_id: int, name: str, description: str) -> None:
+def update_task(list_id: int, task_id: int, name: Optional[str], description: Optional[str]) -> None:
+    # Only the fields that are given are written; at least one must be
+    fields = {field: value for field, value in (("name", name), ("description", description)) if value is not None}
     table.update_item(
         Key={"pk": list_key(list_id), "sk": task_key(task_id)},
-        UpdateExpression="SET #name = :name, #description = :description",
-        ExpressionAttributeNames={"#name": "name", "#description": "description"},
-        ExpressionAttributeValues={":name": name, ":description": description},
+        UpdateExpression="SET " + ", ".join(f"#{field} = :{field}" for field in fields),
+        ExpressionAttributeNames={f"#{field}": field for field in fields},
+        ExpressionAttributeValues={f":{field}": value for field, value in fields.items()},
         ConditionExpression="attribute_exists(pk)",
     )
 
 
 def delete_task(list_id: int, task_id: int) -> None:
-    table.delete_item(Key={"pk": list_key(list_id), "sk": task_key(task_id)})
+    # Deleting a task that does not exist succeeds and leaves taskCount alone
+    delete_existing_tasks(list_id, [task_id])
+
+
+def delete_existing_tasks(list_id: int, task_ids: list[int]) -> set[int]:
+    # Deletes at most TASK_CHUNK distinct tasks in one transaction, dropping the ones that are already gone, and
+    # returns those
+    gone = set()
+    while task_ids:
+        deletes = [
+            {
+                "Delete": {
+                    "TableName": table.name,
+                    "Key": {"pk": list_key(list_id), "sk": task_key(task_id)},
+                    "ConditionExpression": "attribute_exists(pk)",
+                }
+            }
+            for task_id in task_ids
+        ]
+        try:
+            write_tasks(list_id, deletes, -len(task_ids))
+            return gone
+        except TransactionCancelled as e:
+            missing = {task_id for task_id, reason in zip(task_ids, e.reasons) if reason == "ConditionalCheckFailed"}
+            if not missing:
+                raise
+            gone |= missing
+            task_ids = [task_id for task_id in task_ids if task_id not in missing]
+    return gone
+
+
+# Batch operations on the tasks of one list. Each returns one entry per input item, in input order: the task ID,
+# or None where that item failed.
+
+
+def create_tasks(list_id: int, tasks: list[dict]) -> list[Optional[int]]:
+    # All IDs come from a single lease. Chunks are written one after another, since each one also updates the
+    # list's taskCount and concurrent transactions on that item would only conflict.
+    task_ids = task_id_allocator(list_id).allocate_many(len(tasks)) if tasks else []
+    results = []
+    for chunk in chunked(list(zip(task_ids, tasks)), TASK_CHUNK):
+        try:
+            put_tasks(
+                list_id,
+                [task_item(list_id, task_id, task["name"], task.get("description")) for task_id, task in chunk],
+            )
+            results.extend(task_id for task_id, _ in chunk)
+        except TransactionCancelled:
+            results.extend(None for _ in chunk)
+    return results
+
+
+def update_tasks(list_id: int, tasks: list[dict]) -> list[Optional[int]]:
+    # BatchWriteItem cannot carry a condition and would recreate deleted tasks, so updates stay individual
+    # conditional writes, run concurrently
+    def update(task: dict) -> Optional[int]:
+        from botocore.exceptions import ClientError
+
+        try:
+            update_task(list_id, task["taskId"], task.get("name"), task.get("description"))
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return None
+        return task["taskId"]
+
+    return concurrency.map_ordered(update, tasks)
+
+
+def delete_tasks(list_id: int, task_ids: list[int]) -> list[Optional[bool]]:
+    # Unlike the other batch operations, returns per input item whether the task was found and deleted: False where
+    # it did not exist or repeats an earlier item (transactions reject duplicate keys), None where the delete failed
+    failed = set()
+    missing = set()
+    for chunk in chunked(list(dict.fromkeys(task_ids)), TASK_CHUNK):
+        try:
+            missing |= delete_existing_tasks(list_id, chunk)
+        except TransactionCancelled:
+            failed.update(chunk)
+    results = []
+    seen = set()
+    for task_id in task_ids:
+        if task_id in failed:
+            results.append(None)
+        else:
+            results.append(task_id not in missing and task_id not in seen)
+        seen.add(task_id)
+    return results
+
+
+# Each share made through the API is recorded twice: next to its list (pk LIST#..., sk SHARE#<user>) and under its
+# user (pk SHARED#<user>, sk LIST#...), each time with the role and the ID of the template-linked policy behind it.
+# Changing or removing a share then needs no ListPolicies call to find that policy, and the shares of a list or of a
+# user are one query. Both records are written in one transaction whenever a share changes;
+# tools/reconcile_share_records.py repairs them where they have drifted from the policy store.
+def share_key(list_id: int, user: str) -> dict:
+    return {"pk": list_key(list_id), "sk": f"SHARE#{user}"}
+
+
+def shared_key(list_id: int, user: str) -> dict:
+    return {"pk": shared_partition(user), "sk": list_key(list_id)}
+
+
+def shared_partition(user: str) -> str:
+    return f"SHARED#{user}"
+
+
+def share_items(list_id: int, user: str, role: str, policy_id: str) -> list[dict]:
+    attributes = {"listId": Decimal(list_id), "user": user, "role": role, "policyId": policy_id}
+    return [{**key, **attributes} for key in (share_key(list_id, user), shared_key(list_id, user))]
+
+
+def get_share(list_id: int, user: str) -> Optional[dict]:
+    return table.get_item(Key=share_key(list_id, user), ConsistentRead=True).get("Item")
+
+
+def list_shares(list_id: int) -> list[Share]:
+    return [Share.from_item(item) for item in query_items(**SHARES_BY_LIST.arguments(list_key(list_id)))]
+
+
+def list_shared(user: str) -> dict[int, str]:
+    # List ID -> role of every list shared with the user
+    items = query_items(**SHARES_BY_USER.arguments(shared_partition(user)))
+    return {int(item["listId"]): item["role"] for item in items}
+
+
+def put_share(list_id: int, user: str, role: str, policy_id: str, new: bool = False) -> None:
+    # With new=True the put fails with ShareExists when the list is already shared with the user
+    condition = {"ConditionExpression": "attribute_not_exists(pk)"} if new else {}
+    actions = [
+        {"Put": {"TableName": table.name, "Item": item, **condition}}
+        for item in share_items(list_id, user, role, policy_id)
+    ]
+    try:
+        transact_write(actions)
+    except TransactionCancelled as e:
+        if "ConditionalCheckFailed" in e.reasons:
+            raise ShareExists(f"{user} on list {list_id}")
+        raise
+
+
+def delete_share(list_id: int, user: str, policy_id: str) -> None:
+    # Only removes the records while they still point at policy_id, so a concurrent update of the share survives
+    actions = [
+        {
+            "Delete": {
+                "TableName": table.name,
+                "Key": key,
+                "ConditionExpression": "attribute_not_exists(pk) OR policyId = :policy",
+                "ExpressionAttributeValues": {":policy": policy_id},
+            }
+        }
+        for key in (share_key(list_id, user), shared_key(list_id, user))
+    ]
+    try:
+        transact_write(actions)
+    except TransactionCancelled as e:
+        if "ConditionalCheckFailed" not in e.reasons:
+            raise
+
+
+def chunked(items: list, size: int) -> list[list]:
+    return [items[start : start + size] for start in range(0, len(items), size)]
@@ -0,0 +1,188 @@
+from decimal import Decimal
+from typing import Optional
+
+import clients
+
+# A thin stand-in for the parts of the boto3 DynamoDB resource that database.py uses (Table methods and
+# batch_get_item), implemented on the low-level client. Items go in and come out in the same plain Python shape as
+# with the resource (strings, Decimals, dicts, lists, sets), without loading the resource model at cold start.
+# Expressions are always strings with explicit ExpressionAttributeValues.
+
+
+def serialize(value) -> dict:
+    if value is None:
+        return {"NULL": True}
+    if isinstance(value, bool):
+        return {"BOOL": value}
+    if isinstance(value, str):
+        return {"S": value}
+    if isinstance(value, (int, Decimal)):
+        return {"N": str(value)}
+    if isinstance(value, (bytes, bytearray)):
+        return {"B": bytes(value)}
+    if isinstance(value, dict):
+        return {"M": {key: serialize(member) for key, member in value.items()}}
+    if isinstance(value, (list, tuple)):
+        return {"L": [serialize(member) for member in value]}
+    if isinstance(value, (set, frozenset)) and value:
+        if all(isinstance(member, str) for member in value):
+            return {"SS": sorted(value)}
+        if all(isinstance(member, (int, Decimal)) and not isinstance(member, bool) for member in value):
+            return {"NS": [str(member) for member in value]}
+    raise TypeError(f"Unsupported type for DynamoDB: {type(value)}")
+
+
+def deserialize(attribute: dict):
+    ((kind, value),) = attribute.items()
+    if kind == "S":
+        return value
+    if kind == "N":
+        return Decimal(value)
+    if kind in ("BOOL", "B"):
+        return value
+    if kind == "NULL":
+        return None
+    if kind == "M":
+        return {key: deserialize(member) for key, member in value.items()}
+    if kind == "L":
+        return [deserialize(member) for member in value]
+    if kind in ("SS", "BS"):
+        return set(value)
+    if kind == "NS":
+        return {Decimal(member) for member in value}
+    raise TypeError(f"Unknown DynamoDB type: {kind}")
+
+
+def serialize_item(item: dict) -> dict:
+    return {key: serialize(value) for key, value in item.items()}
+
+
+def deserialize_item(item: dict) -> dict:
+    return {key: deserialize(value) for key, value in item.items()}
+
+
+def serialize_arguments(kwargs: dict) -> dict:
+    for name in ("ExpressionAttributeValues", "ExclusiveStartKey"):
+        if name in kwargs:
+            kwargs[name] = serialize_item(kwargs[name])
+    return kwargs
+
+
+def serialize_keys(request: dict) -> dict:
+    # Item and Key of a single write, as found in TransactWriteItems requests
+    for name in ("Item", "Key"):
+        if name in request:
+            request[name] = serialize_item(request[name])
+    return request
+
+
+def deserialize_response(resp: dict) -> dict:
+    for name in ("Item", "Attributes", "LastEvaluatedKey"):
+        if name in resp:
+            resp[name] = deserialize_item(resp[name])
+    if "Items" in resp:
+        resp["Items"] = [deserialize_item(item) for item in resp["Items"]]
+    return resp
+
+
+class Table:
+    # Methods taking raw=True skip the marshalling layer: keys and ExpressionAttributeValues are passed in wire format
+    # and items come back as attribute maps ({"name": {"S": ...}}), for callers that decode them directly. Start and
+    # last evaluated keys are still converted, so page tokens look the same on both paths.
+    def __init__(self, name: str):
+        self.name = name
+
+    @property
+    def client(self):
+        return clients.client("dynamodb")
+
+    def get_item(self, Key: dict, raw: bool = False, **kwargs) -> dict:
+        if raw:
+            return self.client.get_item(TableName=self.name, Key=Key, **kwargs)
+        return deserialize_response(self.client.get_item(TableName=self.name, Key=serialize_item(Key), **kwargs))
+
+    def put_item(self, Item: dict, **kwargs) -> dict:
+        resp = self.client.put_item(TableName=self.name, Item=serialize_item(Item), **serialize_arguments(kwargs))
+        return deserialize_response(resp)
+
+    def update_item(self, Key: dict, **kwargs) -> dict:
+        resp = self.client.update_item(TableName=self.name, Key=serialize_item(Key), **serialize_arguments(kwargs))
+        return deserialize_response(resp)
+
+    def delete_item(self, Key: dict, **kwargs) -> dict:
+        resp = self.client.delete_item(TableName=self.name, Key=serialize_item(Key), **serialize_arguments(kwargs))
+        return deserialize_response(resp)
+
+    def query(self, raw: bool = False, **kwargs) -> dict:
+        if not raw:
+            return deserialize_response(self.client.query(TableName=self.name, **serialize_arguments(kwargs)))
+
+        if "ExclusiveStartKey" in kwargs:
+            kwargs["ExclusiveStartKey"] = serialize_item(kwargs["ExclusiveStartKey"])
+        resp = self.client.query(TableName=self.name, **kwargs)
+        if "LastEvaluatedKey" in resp:
+            resp["LastEvaluatedKey"] = deserialize_item(resp["LastEvaluatedKey"])
+        return resp
+
+
+class DynamoDB:
+    def Table(self, name: str) -> Table:
+        return Table(name)
+
+    def transact_write_items(self, TransactItems: list, **kwargs) -> dict:
+        items = [
+            {operation: serialize_arguments(serialize_keys(dict(request))) for operation, request in item.items()}
+            for item in TransactItems
+        ]
+        return clients.client("dynamodb").transact_write_items(TransactItems=items, **kwargs)
+
+    def batch_get_item(self, RequestItems: dict, raw: bool = False, **kwargs) -> dict:
+        if raw:
+            return clients.client("dynamodb").batch_get_item(RequestItems=RequestItems, **kwargs)
+
+        request = {
+            name: {**table_request, "Keys": [serialize_item(key) for key in table_request["Keys"]]}
+            for name, table_request in RequestItems.items()
+        }
+        resp = clients.client("dynamodb").batch_get_item(RequestItems=request, **kwargs)
+        return {
+            "Responses": {
+                name: [deserialize_item(item) for item in items] for name, items in resp.get("Responses", {}).items()
+            },
+            "UnprocessedKeys": {
+                name: {**table_request, "Keys": [deserialize_item(key) for key in table_request["Keys"]]}
+                for name, table_request in resp.get("UnprocessedKeys", {}).items()
+            },
+        }
+
+
+def key_condition(partition_key: str, partition_value, sort_prefix: Optional[str] = None) -> dict:
+    # Query arguments for "partition key equals X [and sort key begins with Y]"
+    kwargs = {
+        "KeyConditionExpression": "#pk = :pk",
+        "ExpressionAttributeNames": {"#pk": partition_key},
+        "ExpressionAttributeValues": {":pk": partition_value},
+    }
+    if sort_prefix is not None:
+        kwargs["KeyConditionExpression"] += " AND begins_with(#sk, :sk)"
+        kwargs["ExpressionAttributeNames"]["#sk"] = "sk"
+        kwargs["ExpressionAttributeValues"][":sk"] = sort_prefix
+    return kwargs
+
+
+class QueryTemplate:
+    # The key condition, attribute names and constant values of a query are built (and marshalled) once, so a call
+    # only has to fill in the partition value
+    def __init__(self, partition_key: str, sort_prefix: Optional[str] = None, index_name: Optional[str] = None):
+        self.static = key_condition(partition_key, "", sort_prefix)
+        self.values = self.static.pop("ExpressionAttributeValues")
+        self.raw_values = serialize_item(self.values)
+        if index_name is not None:
+            self.static["IndexName"] = index_name
+
+    def arguments(self, partition_value, raw: bool = False) -> dict:
+        if raw:
+            values = {**self.raw_values, ":pk": serialize(partition_value)}
+        else:
+            values = {**self.values, ":pk": partition_value}
+        return {**self.static, "ExpressionAttributeValues": values}
@@ -1,10 +1,18 @@
-from jose import JWTError
+from dataclasses import dataclass
+from typing import Callable, Optional
+import base64
+import gzip
+import hashlib
 import json
-import jwt
+import os
+import zlib
 
+import concurrency
 import database
 import permissions
-from util import debug_object
+import tokens
+from api_types import List, to_json
+from util import debug_object, info, warning
 
 Response = object
 
@@ -19,6 +27,10 @@ ACTIONS = {
     ("/task/read", "GET"): "ReadTask",
     ("/task/update", "PUT"): "UpdateTask",
     ("/task/delete", "DELETE"): "DeleteTask",
+    # Task batches within one list
+    ("/task/batch-create", "POST"): "BatchCreateTasks",
+    ("/task/batch-update", "PUT"): "BatchUpdateTasks",
+    ("/task/batch-delete", "DELETE"): "BatchDeleteTasks",
     # Share CRUD
     ("/share/create", "POST"): "CreateShare",
     ("/share/read", "GET"): "ReadShare",
@@ -32,64 +44,182 @@ ACTIONS = {
 }
 
 
+# Bodies of at least COMPRESS_MIN_BYTES are compressed when the client accepts gzip or deflate; below that the
+# base64 overhead and the CPU cost outweigh the savings
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+COMPRESSORS = {
+    "gzip": lambda data: gzip.compress(data, mtime=0),
+    "deflate": zlib.compress,
+}
+
+
+class InvalidInput(Exception):
+    pass
+
+
+def page_limit(value) -> int:
+    limit = int(value)
+    if not 0 < limit <= database.MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {database.MAX_PAGE_SIZE}")
+    return limit
+
+
+def unchanged(value):
+    return value
+
+
+def string(value) -> str:
+    # Values that are used as strings, which a JSON body could give as anything
+    if not isinstance(value, str):
+        raise ValueError("expected a string")
+    return value
+
+
+def batch(value) -> list:
+    if not isinstance(value, list) or len(value) > database.MAX_BATCH_TASKS:
+        raise ValueError(f"expected a list of at most {database.MAX_BATCH_TASKS} entries")
+    return value
+
+
+def task_fields(value) -> list[dict]:
+    # The name and description given for each task, plus a taskId where one is given (required by batch updates).
+    # Fields a task does not give are left out, so that an update leaves them alone.
+    tasks = []
+    for task in batch(value):
+        if not isinstance(task, dict):
+            raise ValueError("each task must be an object")
+        fields = {name: task[name] for name in ("name", "description") if name in task}
+        if not all(isinstance(field, str) for field in fields.values()):
+            raise ValueError("task names and descriptions must be strings")
+        if "taskId" in task:
+            fields["taskId"] = int(task["taskId"])
+        tasks.append(fields)
+    return tasks
+
+
+def field_names(value) -> tuple[str, ...]:
+    # fields=id,name selects the returned fields; "summary" stands for the summary shape's fields
+    names = []
+    for name in string(value).split(","):
+        names.extend(database.SUMMARY_FIELDS if name.strip() == "summary" else [name.strip()])
+    return tuple(dict.fromkeys(names))
+
+
+def task_ids(value) -> list[int]:
+    return [int(task_id) for task_id in batch(value)]
+
+
+# How each request field (body for writes, query string for reads) is parsed
+FIELD_PARSERS = {
+    "listId": int,
+    "taskId": int,
+    "name": unchanged,
+    "description": unchanged,
+    "role": unchanged,
+    "user": unchanged,
+    "limit": page_limit,
+    "nextToken": string,
+    "tasks": task_fields,
+    "taskIds": task_ids,
+    "fields": field_names,
+}
+
+
+@dataclass(frozen=True)
+class Route:
+    action: str
+    policy_action: str
+    handle: Callable[..., Response]
+    # Positional arguments of `handle`: request fields, or "principal" / "taskList" from the request context
+    params: tuple
+    fields: tuple
+    hydrate_list: bool
+    resolve_user: bool
+    speculative: bool
+
+    def extract(self, values: dict) -> dict:
+        args = {}
+        for field in self.fields:
+            if field in values:
+                try:
+                    args[field] = FIELD_PARSERS[field](values[field])
+                except (TypeError, ValueError):
+                    raise InvalidInput(field)
+        return args
+
+
+class RequestContext:
+    # Entities loaded at most once per invocation and shared by the existence check, the permissions check and
+    # the action itself. The list read starts as soon as the context exists, alongside the other lookups.
+    def __init__(self, principal: str, list_id: Optional[int]):
+        self.principal = principal
+        self.list_id = list_id
+        self._task_list = concurrency.submit(database.get_list, list_id) if list_id else concurrency.completed(None)
+
+    @property
+    def task_list(self) -> Optional[List]:
+        return self._task_list.result()
+
+
 def handler(event, context) -> Response:
     debug_object(event)
     debug_object(context)
+    return negotiate(event, respond(event))
+
 
+def respond(event) -> Response:
     # Get the information about the requested action
-    resource = event["resource"]
-    method = event["httpMethod"]
-    action = ACTIONS.get((resource, method), "Unknown")
-    if action == "Unknown":
+    route = ROUTES.get((event["resource"], event["httpMethod"]))
+    if route is None:
         return format_response({"message": "Unknown API call"}, 404)
+    action = route.policy_action
 
     # Get the information about the principal from the JWT token
     access_token = event["headers"]["Authorization"].split(" ")[1]
     try:
-        jwt_claims = jwt.decode(access_token, options={"verify_signature": False})
+        jwt_claims = tokens.decode_access_token(access_token)
         debug_object(jwt_claims)
         user_pool_id = jwt_claims["iss"].split("/")[-1]
         principal = "{}|{}".format(user_pool_id, jwt_claims["sub"])
-    except JWTError as e:
-        debug_object(e)
+    except (tokens.InvalidToken, KeyError) as e:
+        warning(e)
         return format_response({"message": "Access denied -- token broken"}, 401)
 
-    # Variables that exist only on some requests
-    list_id = None
-    task_id = None
-    user = None
-    name = None
-    description = None
-    role = None
-    if event["body"]:
-        body = json.loads(event["body"])
-        name = body["name"] if "name" in body else None
-        description = body["description"] if "description" in body else None
-        role = body["role"] if "role" in body else None
-        list_id = int(body["listId"]) if "listId" in body else None
-        task_id = int(body["taskId"]) if "taskId" in body else None
-        if "user" in body:
-            user = body["user"]
-            if user != principal:
-                user = database.query_user_key(user)
-                print("Using: {} to use as share key".format(user))
-            if user == "":
-                return format_response({"message": "Invalid input -- user doesn't exist."}, 401)
-    elif event["queryStringParameters"]:
-        list_id = int(event["queryStringParameters"]["listId"]) if "listId" in event["queryStringParameters"] else None
-        task_id = int(event["queryStringParameters"]["taskId"]) if "taskId" in event["queryStringParameters"] else None
+    # Only the fields this action uses are read from the request
+    try:
+        args = route.extract(request_values(event))
+    except InvalidInput as e:
+        return format_response({"message": f"Invalid input -- bad {e}"}, 400)
+
+    # The list read, the share user lookup, the permissions check and (for read-only actions) the action itself
+    # do not depend on each other's results, so they are all in flight together. Speculative reads have no side
+    # effects and their result is thrown away unless the permissions check allows the action.
+    request = RequestContext(principal, args.get("listId") if route.hydrate_list else None)
+    speculative = None
+    if route.speculative:
+        values = {**args, "principal": principal}
+        speculative = concurrency.submit(route.handle, *(values.get(param) for param in route.params))
+
+    if route.resolve_user and "user" in args:
+        if args["user"] != principal:
+            args["user"] = database.query_user_key(args["user"])
+            info("Using: %s to use as share key", args["user"])
+        if args["user"] == "":
+            return format_response({"message": "Invalid input -- user doesn't exist."}, 401)
 
     # Check if the list exists
-    if list_id and database.get_list(list_id) is None:
+    task_list = request.task_list
+    if request.list_id and task_list is None:
         return format_response({"message": "Invalid input -- list doesn't exist"}, 400)
-    task_list = list_id and database.get_list(list_id)
 
     debug_object(principal)
     debug_object(action)
     debug_object(task_list)
 
     # Basic permissions check
-    if permissions.permissions_check(principal, action, task_list) == "DENY":
+    decision = permissions.permissions_check(principal, action, task_list)
+    debug_object(lambda: {"decisionCache": permissions.decision_cache.stats()})
+    if decision == "DENY":
         return format_response({"message": "Access denied -- permissions check failed"}, 401)
     # id_token = event.get("headers", {}).get("id-token")
     # if not id_token:
@@ -100,46 +230,32 @@ def handler(event, context) -> Response:
     # except Exception as e:
     #     return format_response({"message": f"Access denied -- permissions check failed - {str(e)}"}, 401)
 
-    if action == "ListLists":
-        return list_lists(principal)
-    elif action == "CreateList":
-        return create_list(principal, name, description)
-    elif action == "ReadList":
-        return get_list(list_id)
-    elif action == "UpdateList":
-        return update_list(list_id, name, description)
-    elif action == "DeleteList":
-        return delete_list(list_id)
-    elif action == "ListTasks":
-        return list_tasks(list_id)
-    elif action == "CreateTask":
-        return create_task(list_id, name, description)
-    elif action == "UpdateTask":
-        return update_task(list_id, task_id, name, description)
-    elif action == "DeleteTask":
-        return delete_task(list_id, task_id)
-    elif action == "ListShares":
-        return list_shares(list_id)
-    elif action == "CreateShare":
-        return create_share(list_id, user, role)
-    elif action == "UpdateShare":
-        return update_share(list_id, user, role)
-    elif action == "DeleteShare":
-        return delete_share(list_id, user)
-    elif action == "ListSharedLists":
-        return list_shared_lists(principal)
-
-
-def list_lists(user: str) -> Response:
-    return format_response({"lists": database.list_lists(user)})
-
-
-def create_list(user: str, name: str, description: str) -> Response:
-    return format_response({"listId": database.create_list(user, name, description)})
-
-
-def get_list(list_id: int) -> Response:
-    return format_response({"list": database.get_list(list_id)})
+    if speculative is not None:
+        return speculative.result()
+    args.update(principal=principal, taskList=task_list)
+    return route.handle(*(args.get(param) for param in route.params))
+
+
+def list_lists(user: str, limit: Optional[int], next_token: Optional[str], fields: Optional[tuple]) -> Response:
+    try:
+        if limit is None and next_token is None:
+            return format_response({"lists": list(database.list_lists(user, fields))})
+        lists, next_token = database.list_lists_page(user, limit or database.DEFAULT_PAGE_SIZE, next_token, fields)
+    except database.InvalidPageToken:
+        return format_response({"message": "Invalid input -- bad nextToken"}, 400)
+    except database.UnknownField:
+        return format_response({"message": "Invalid input -- bad fields"}, 400)
+    return format_response({"lists": lists, "nextToken": next_token})
+
+
+def create_list(user: str, name: str, description: str, tasks: Optional[list[dict]]) -> Response:
+    if tasks is not None and any("name" not in task for task in tasks):
+        return format_response({"message": "Invalid input -- bad tasks"}, 400)
+    return format_response({"listId": database.create_list(user, name, description, tasks)})
+
+
+def get_list(task_list: List) -> Response:
+    return format_response({"list": task_list})
 
 
 def update_list(list_id: int, name: str, description: str) -> Response:
@@ -148,25 +264,32 @@ def update_list(list_id: int, name: str, description: str) -> Response:
 
 
 def delete_list(list_id: int) -> Response:
-    task_count = database.count_tasks(list_id)
-
-    # Note: Race condition allows us to delete lists that have tasks added at the last moment. Oh, well.
-    if task_count > 0:
-        return format_response({"message": "List not empty"}, 400)
-    else:
+    try:
         database.delete_list(list_id)
-        return format_response({})
+    except database.ListNotEmpty:
+        return format_response({"message": "List not empty"}, 400)
+    return format_response({})
 
 
-def list_tasks(list_id: int) -> Response:
-    return format_response({"tasks": database.list_tasks(list_id)})
+def list_tasks(list_id: int, limit: Optional[int], next_token: Optional[str], fields: Optional[tuple]) -> Response:
+    try:
+        if limit is None and next_token is None:
+            return format_response({"tasks": list(database.list_tasks(list_id, fields))})
+        tasks, next_token = database.list_tasks_page(list_id, limit or database.DEFAULT_PAGE_SIZE, next_token, fields)
+    except database.InvalidPageToken:
+        return format_response({"message": "Invalid input -- bad nextToken"}, 400)
+    except database.UnknownField:
+        return format_response({"message": "Invalid input -- bad fields"}, 400)
+    return format_response({"tasks": tasks, "nextToken": next_token})
 
 
 def create_task(list_id: int, name: str, description: str) -> Response:
     return format_response({"taskId": database.create_task(list_id, name, description)})
 
 
-def update_task(list_id: int, task_id: int, name: str, description: str) -> Response:
+def update_task(list_id: int, task_id: int, name: Optional[str], description: Optional[str]) -> Response:
+    if name is None and description is None:
+        return format_response({"message": "Invalid input -- bad name"}, 400)
     database.update_task(list_id, task_id, name, description)
     return format_response({})
 
@@ -176,6 +299,45 @@ def delete_task(list_id, task_id) -> Response:
     return format_response({})
 
 
+def batch_create_tasks(list_id: int, tasks: Optional[list[dict]]) -> Response:
+    if tasks is None or any("name" not in task for task in tasks):
+        return format_response({"message": "Invalid input -- bad tasks"}, 400)
+    created = database.create_tasks(list_id, tasks)
+    errors = ["Task was not written"] * len(tasks)
+    return format_response({"results": batch_results(created, [None] * len(tasks), errors)})
+
+
+def batch_update_tasks(list_id: int, tasks: Optional[list[dict]]) -> Response:
+    if tasks is None or any("taskId" not in task or len(task) == 1 for task in tasks):
+        return format_response({"message": "Invalid input -- bad tasks"}, 400)
+    updated = database.update_tasks(list_id, tasks)
+    errors = ["Task doesn't exist"] * len(tasks)
+    return format_response({"results": batch_results(updated, [task["taskId"] for task in tasks], errors)})
+
+
+def batch_delete_tasks(list_id: int, task_ids: Optional[list[int]]) -> Response:
+    if task_ids is None:
+        return format_response({"message": "Invalid input -- bad taskIds"}, 400)
+    found = database.delete_tasks(list_id, task_ids)
+    # A task that was already gone, or that an earlier entry of the batch deleted, is reported as not existing
+    deleted = [task_id if task_found else None for task_id, task_found in zip(task_ids, found)]
+    errors = ["Task was not deleted" if task_found is None else "Task doesn't exist" for task_found in found]
+    return format_response({"results": batch_results(deleted, task_ids, errors)})
+
+
+def batch_results(task_ids: list[Optional[int]], requested_ids: list[Optional[int]], errors: list[str]) -> list[dict]:
+    # One entry per requested task, in request order, with the error message of each task that failed
+    results = []
+    for task_id, requested_id, message in zip(task_ids, requested_ids, errors):
+        if task_id is not None:
+            results.append({"taskId": task_id})
+        elif requested_id is None:
+            results.append({"error": message})
+        else:
+            results.append({"taskId": requested_id, "error": message})
+    return results
+
+
 def list_shares(list_id: int) -> Response:
     return format_response({"shares": permissions.list_shares(list_id)})
 
@@ -189,12 +351,18 @@ def create_share(list_id: int, user: str, role: str) -> Response:
 
 
 def update_share(list_id: int, user: str, role: str) -> Response:
-    permissions.update_share(list_id, user, role)
+    try:
+        permissions.update_share(list_id, user, role)
+    except permissions.ShareNotFound:
+        return format_response({"message": "Invalid input -- share doesn't exist"}, 400)
     return format_response({})
 
 
 def delete_share(list_id: int, user: str) -> Response:
-    permissions.delete_share(list_id, user)
+    try:
+        permissions.delete_share(list_id, user)
+    except permissions.ShareNotFound:
+        return format_response({"message": "Invalid input -- share doesn't exist"}, 400)
     return format_response({})
 
 
@@ -202,6 +370,84 @@ def list_shared_lists(user: str) -> Response:
     return format_response({"sharedLists": permissions.list_shared_lists(user)})
 
 
+def request_values(event) -> dict:
+    # The JSON object in the body of writes, or the query string of reads
+    if not event["body"]:
+        return event["queryStringParameters"] or {}
+    try:
+        values = json.loads(request_body(event))
+    except ValueError:
+        raise InvalidInput("body")
+    if not isinstance(values, dict):
+        raise InvalidInput("body")
+    return values
+
+
+def request_body(event) -> str:
+    # Every media type is binary to API Gateway (so compressed responses pass through), which base64-encodes bodies
+    return base64.b64decode(event["body"]).decode() if event.get("isBase64Encoded") else event["body"]
+
+
+def header(event, name: str) -> Optional[str]:
+    name = name.lower()
+    for key, value in (event.get("headers") or {}).items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def content_coding(accept_encoding: Optional[str]) -> Optional[str]:
+    # The accepted coding with the highest q-value, gzip before deflate on a tie
+    weights = {}
+    for part in (accept_encoding or "").split(","):
+        coding, *params = [piece.strip() for piece in part.split(";")]
+        weight = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding.lower()] = weight
+    best = max(COMPRESSORS, key=lambda coding: weights.get(coding, weights.get("*", 0.0)))
+    return best if weights.get(best, weights.get("*", 0.0)) > 0 else None
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in tags)
+
+
+def negotiate(event, response: dict) -> Response:
+    # Successful GETs carry a strong ETag of the body and become a bodiless 304 when the client already has that
+    # representation. Large bodies are compressed as the client's Accept-Encoding allows; the ETag then names the
+    # coding as well, since a strong validator must differ between representations.
+    headers = response["headers"]
+    data = response["body"].encode()
+    coding = None
+    if len(data) >= COMPRESS_MIN_BYTES:
+        headers["Vary"] = "Accept-Encoding"
+        coding = content_coding(header(event, "Accept-Encoding"))
+
+    if event["httpMethod"] == "GET" and response["statusCode"] == 200:
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        headers["ETag"] = f'"{digest}-{coding}"' if coding else f'"{digest}"'
+        headers["Cache-Control"] = "private, no-cache"
+        headers["Access-Control-Expose-Headers"] = "ETag"
+        if etag_matches(header(event, "If-None-Match"), headers["ETag"]):
+            del headers["Content-Type"]
+            return {"statusCode": 304, "headers": headers, "body": ""}
+
+    if coding:
+        headers["Content-Encoding"] = coding
+        response["body"] = base64.b64encode(COMPRESSORS[coding](data)).decode()
+        response["isBase64Encoded"] = True
+    return response
+
+
 def format_response(body: object, status_code=200) -> object:
     result = {
         "statusCode": status_code,
@@ -209,7 +455,63 @@ def format_response(body: object, status_code=200) -> object:
             "Content-Type": "application/json",
             "Access-Control-Allow-Origin": "*",
         },
-        "body": json.dumps(body, default=lambda o: o.__dict__),
+        "body": to_json(body),
     }
     debug_object(result)
     return result
+
+
+ACTION_HANDLERS = {
+    "ListLists": (list_lists, ("principal", "limit", "nextToken", "fields")),
+    "CreateList": (create_list, ("principal", "name", "description", "tasks")),
+    "ReadList": (get_list, ("taskList",)),
+    "UpdateList": (update_list, ("listId", "name", "description")),
+    "DeleteList": (delete_list, ("listId",)),
+    "ListTasks": (list_tasks, ("listId", "limit", "nextToken", "fields")),
+    "CreateTask": (create_task, ("listId", "name", "description")),
+    "UpdateTask": (update_task, ("listId", "taskId", "name", "description")),
+    "DeleteTask": (delete_task, ("listId", "taskId")),
+    "BatchCreateTasks": (batch_create_tasks, ("listId", "tasks")),
+    "BatchUpdateTasks": (batch_update_tasks, ("listId", "tasks")),
+    "BatchDeleteTasks": (batch_delete_tasks, ("listId", "taskIds")),
+    "ListShares": (list_shares, ("listId",)),
+    "CreateShare": (create_share, ("listId", "user", "role")),
+    "UpdateShare": (update_share, ("listId", "user", "role")),
+    "DeleteShare": (delete_share, ("listId", "user")),
+    "ListSharedLists": (list_shared_lists, ("principal",)),
+}
+
+
+# Batch actions are authorised once per request, as the single-task action they repeat
+POLICY_ACTIONS = {
+    "BatchCreateTasks": "CreateTask",
+    "BatchUpdateTasks": "UpdateTask",
+    "BatchDeleteTasks": "DeleteTask",
+}
+
+READ_ONLY_ACTIONS = {"ListLists", "ReadList", "ListTasks", "ListShares", "ListSharedLists"}
+
+
+def build_routes() -> dict:
+    routes = {}
+    for key, action in ACTIONS.items():
+        if action not in ACTION_HANDLERS:
+            continue
+        handle, params = ACTION_HANDLERS[action]
+        fields = tuple(param for param in params if param in FIELD_PARSERS)
+        if "taskList" in params:
+            fields += ("listId",)
+        routes[key] = Route(
+            action=action,
+            policy_action=POLICY_ACTIONS.get(action, action),
+            handle=handle,
+            params=params,
+            fields=fields,
+            hydrate_list="listId" in fields,
+            resolve_user="user" in fields,
+            speculative=action in READ_ONLY_ACTIONS and "taskList" not in params,
+        )
+    return routes
+
+
+ROUTES = build_routes()
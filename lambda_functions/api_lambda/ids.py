@@ -0,0 +1,77 @@
+import itertools
+import random
+import threading
+import time
+from typing import Callable
+
+# IDs are handed out from blocks leased from a DynamoDB counter, so most creates need no counter write at all. A
+# lease(count) function reserves `count` IDs atomically and returns them as a range; leases never overlap, and IDs
+# left in a block when a container goes away are simply never used, which only leaves gaps in the sequence.
+Lease = Callable[[int], range]
+
+# 2023-01-01T00:00:00Z. Time-sortable IDs count seconds from here.
+ID_EPOCH = 1672531200
+SEQUENCE_BITS = 21
+
+
+class BlockAllocator:
+    # The block size adapts to this container's create rate: it doubles while blocks run out faster than
+    # target_interval / 2 and halves when one lasts longer than 2 * target_interval, within [min_block, max_block].
+    def __init__(self, lease: Lease, min_block: int = 1, max_block: int = 1000, target_interval: float = 10.0):
+        self.lease = lease
+        self.min_block = max(1, min_block)
+        self.max_block = max(self.min_block, max_block)
+        self.target_interval = target_interval
+        self.block_size = self.min_block
+        self.block = iter(())
+        self.leased_at = None
+        self.lock = threading.Lock()
+
+    def allocate(self) -> int:
+        return self.allocate_many(1)[0]
+
+    def allocate_many(self, count: int) -> list[int]:
+        with self.lock:
+            ids = list(itertools.islice(self.block, count))
+            while len(ids) < count:
+                self.resize()
+                self.block = iter(self.lease(max(self.block_size, count - len(ids))))
+                self.leased_at = time.monotonic()
+                ids.extend(itertools.islice(self.block, count - len(ids)))
+            return ids
+
+    def resize(self) -> None:
+        if self.leased_at is None:
+            return
+        elapsed = time.monotonic() - self.leased_at
+        if elapsed < self.target_interval / 2:
+            self.block_size = min(self.block_size * 2, self.max_block)
+        elif elapsed > self.target_interval * 2:
+            self.block_size = max(self.block_size // 2, self.min_block)
+
+
+def sharded(lease_shard: Callable[[int, int], range], shards: int) -> Lease:
+    # Spreads leases over `shards` counters, each on its own partition key. Value v of shard s stands for ID
+    # v * shards + s, so the shards never hand out the same ID.
+    def lease(count: int) -> range:
+        shard = random.randrange(shards)
+        values = lease_shard(shard, count)
+        return range(values.start * shards + shard, values.stop * shards + shard, shards)
+
+    return lease
+
+
+class TimeSortableAllocator:
+    # ID = seconds since ID_EPOCH << SEQUENCE_BITS | low bits of a counter ID, so IDs sort by creation time. Two IDs
+    # only collide if they are allocated in the same second from counter IDs 2**21 apart. They stay below 2**53
+    # for over a century, so they survive a round trip through JavaScript numbers.
+    def __init__(self, allocator: BlockAllocator):
+        self.allocator = allocator
+
+    def allocate(self) -> int:
+        return self.allocate_many(1)[0]
+
+    def allocate_many(self, count: int) -> list[int]:
+        prefix = (int(time.time()) - ID_EPOCH) << SEQUENCE_BITS
+        mask = (1 << SEQUENCE_BITS) - 1
+        return [prefix | (sequence & mask) for sequence in self.allocator.allocate_many(count)]
@@ -1,22 +1,76 @@
-from typing import Union
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable, Iterator, Union
 
+import json
 import os
-import boto3
+import threading
 
+import cedar
+import clients
+import concurrency
 import database
 from api_types import List, Share, SharedList
-from util import debug_object
+from cache import TTLCache
+from util import DEBUG, debug_object, info, log, warning
 
 POLICY_STORE_ID = os.environ["POLICY_STORE_ID"]
 TASK_LIST_EDITOR_TEMPLATE_ID = os.environ["TASK_LIST_EDITOR_TEMPLATE_ID"]
 TASK_LIST_VIEWER_TEMPLATE_ID = os.environ["TASK_LIST_VIEWER_TEMPLATE_ID"]
-avp = boto3.client("verifiedpermissions")
+avp = clients.LazyClient("verifiedpermissions")
+
+# Decisions are keyed by (principal, action, list id, list owner) and only live for a few seconds, so a policy
+# change made by another container is picked up after at most DECISION_CACHE_TTL seconds.
+decision_cache = TTLCache(
+    maxsize=int(os.environ.get("DECISION_CACHE_SIZE", "1024")),
+    ttl=float(os.environ.get("DECISION_CACHE_TTL", "30")),
+)
+
+# Size and lifetime of the rows and columns of the share index below
+policy_index_size = int(os.environ.get("POLICY_INDEX_SIZE", "1024"))
+policy_index_ttl = float(os.environ.get("POLICY_INDEX_TTL", "60"))
+
+
+# Decisions can also be made in process by the cedar module, from a snapshot of the store's static policies,
+# templates and schema plus the template-linked policies of the share index. LOCAL_AUTHORIZATION selects:
+#   off     Verified Permissions makes every decision
+#   shadow  Verified Permissions decides; each decision is also made locally in the background and mismatches logged
+#   on      decisions are made locally, falling back to Verified Permissions whenever the snapshot cannot be used
+# tests/test_cedar.py checks local decisions for TinyTodo's policies against Verified Permissions' decisions; a
+# change to the policies or to cedar.py needs it green, and a clean shadow run, before it goes out with "on".
+LOCAL_AUTHORIZATION = os.environ.get("LOCAL_AUTHORIZATION", "off").lower()
+policy_snapshot_cache = TTLCache(maxsize=1, ttl=float(os.environ.get("POLICY_SNAPSHOT_TTL", "300")))
+shadow_stats = Counter()
+shadow_stats_lock = threading.Lock()
+
+# ListShares and ListSharedLists read the share records in TinyTodoTable ("records") or the share index built from
+# ListPolicies ("policies"). Switch to records once tools/reconcile_share_records.py has written them for the shares
+# made before they existed.
+SHARE_READS = os.environ.get("SHARE_READS", "policies").lower()
 
 
 class ShareExists(Exception):
     pass
 
 
+class ShareNotFound(Exception):
+    pass
+
+
+class PolicySnapshot:
+    def __init__(self, static: list, templates: dict, action_ancestors: dict, unsupported: str = ""):
+        self.static = static
+        # template id -> parsed policies, and the actions each one grants where that compiles to a set
+        self.templates = templates
+        self.template_actions = {
+            template_id: cedar.granted_actions(policies, action_ancestors)
+            for template_id, policies in templates.items()
+        }
+        self.action_ancestors = action_ancestors
+        # Why the policy store cannot be evaluated locally, if it cannot
+        self.unsupported = unsupported
+
+
 def entity(entity_type: str, entity_id: Union[str, int]) -> dict:
     return {"entityType": f"TinyTodo::{entity_type}", "entityId": str(entity_id)}
 
@@ -36,7 +90,211 @@ def attribute_value(value: any) -> dict:
         raise f"Unknown attribute value type: {type(value)}"
 
 
-def permissions_check(avp_principal: str, action: str, task_list: List) -> bool:
+def decision_key(avp_principal: str, action: str, task_list: List) -> tuple:
+    if task_list:
+        return (avp_principal, action, task_list.id, task_list.owner)
+    return (avp_principal, action, None, None)
+
+
+def invalidate_decisions(list_id: int, user: str) -> None:
+    evicted = decision_cache.invalidate_matching(lambda key: key[0] == user and key[2] == list_id)
+    log(DEBUG, "Evicted %d cached decisions for user %s on list %s", evicted, user, list_id)
+
+
+def iter_policies(**filter) -> Iterator[dict]:
+    kwargs = {"policyStoreId": POLICY_STORE_ID, "filter": filter}
+    while True:
+        resp = avp.list_policies(**kwargs)
+        yield from resp["policies"]
+        if not resp.get("nextToken"):
+            return
+        kwargs["nextToken"] = resp["nextToken"]
+
+
+def load_policy_snapshot() -> PolicySnapshot:
+    # Runs on the fan-out pool in shadow mode, so the calls are made one after another rather than fanned out
+    try:
+        static = []
+        for item in iter_policies(policyType="STATIC"):
+            policy = avp.get_policy(policyStoreId=POLICY_STORE_ID, policyId=item["policyId"])
+            static.extend(cedar.parse(policy["definition"]["static"]["statement"], item["policyId"]))
+
+        templates = {}
+        kwargs = {"policyStoreId": POLICY_STORE_ID}
+        while True:
+            resp = avp.list_policy_templates(**kwargs)
+            for item in resp["policyTemplates"]:
+                template_id = item["policyTemplateId"]
+                template = avp.get_policy_template(policyStoreId=POLICY_STORE_ID, policyTemplateId=template_id)
+                templates[template_id] = cedar.parse(template["statement"], template_id)
+                # Links are looked up in the share index, which only holds links of a principal to a list
+                if any(
+                    policy.principal[1] != "?principal" or policy.resource[1] != "?resource"
+                    for policy in templates[template_id]
+                ):
+                    raise cedar.Unsupported(f"template {template_id} does not link a principal to a resource")
+            if not resp.get("nextToken"):
+                break
+            kwargs["nextToken"] = resp["nextToken"]
+
+        schema = avp.get_schema(policyStoreId=POLICY_STORE_ID).get("schema")
+        ancestors = cedar.action_ancestors(json.loads(schema)) if schema else {}
+    except cedar.Unsupported as e:
+        warning("Policy store cannot be evaluated locally: %s", e)
+        return PolicySnapshot([], {}, {}, unsupported=str(e))
+
+    info("Loaded policy snapshot: %d static policies, %d templates", len(static), len(templates))
+    return PolicySnapshot(static, templates, ancestors)
+
+
+def policy_snapshot() -> PolicySnapshot:
+    return policy_snapshot_cache.get_or_load("snapshot", load_policy_snapshot)
+
+
+@dataclass(frozen=True)
+class ShareLink:
+    __slots__ = ("policy_id", "template_id")
+    policy_id: str
+    template_id: str
+
+
+def patched(mapping: dict, key, transform: Callable[[tuple], tuple]) -> dict:
+    # A copy of `mapping` with mapping[key] replaced by transform(mapping[key]), dropping the key if that is empty
+    links = transform(mapping.get(key, ()))
+    updated = {name: value for name, value in mapping.items() if name != key}
+    if links:
+        updated[key] = links
+    return updated
+
+
+class ShareIndex:
+    # The template-linked share policies compiled into a sparse (user, list) -> links matrix, hashed both ways: a
+    # user's row answers "what may U do on L" with one lookup and "which lists are shared with U" in O(shares),
+    # and a list's column lists its shares. Each row or column is loaded with one complete ListPolicies scan and
+    # kept for POLICY_INDEX_TTL seconds. Share mutations made by this container patch the loaded rows and columns
+    # in place (cached maps are replaced, never mutated); those made elsewhere show up once an entry ages out.
+    def __init__(self, maxsize: int, ttl: float):
+        self.rows = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.columns = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def row(self, user: str) -> dict[int, tuple]:
+        return self.rows.get_or_load(
+            user, lambda: self.load("resource", principal={"identifier": entity("User", user)})
+        )
+
+    def column(self, list_id: int) -> dict[str, tuple]:
+        return self.columns.get_or_load(
+            list_id, lambda: self.load("principal", resource={"identifier": entity("List", list_id)})
+        )
+
+    def links(self, user: str, list_id: int) -> tuple:
+        return self.row(user).get(list_id, ())
+
+    @staticmethod
+    def load(key: str, **filter) -> dict:
+        links = {}
+        for policy in iter_policies(policyType="TEMPLATE_LINKED", **filter):
+            identifier = policy[key]
+            if key == "resource":
+                # Only links to lists are shares
+                if identifier["entityType"] != "TinyTodo::List":
+                    continue
+                name = int(identifier["entityId"])
+            else:
+                name = identifier["entityId"]
+            link = ShareLink(policy["policyId"], policy["definition"]["templateLinked"]["policyTemplateId"])
+            links[name] = links.get(name, ()) + (link,)
+        return links
+
+    def add(self, user: str, list_id: int, link: ShareLink) -> None:
+        self.rows.replace(user, lambda row: patched(row, list_id, lambda links: links + (link,)))
+        self.columns.replace(list_id, lambda column: patched(column, user, lambda links: links + (link,)))
+
+    def remove(self, user: str, list_id: int, policy_id: str) -> None:
+        def drop(links: tuple) -> tuple:
+            return tuple(link for link in links if link.policy_id != policy_id)
+
+        self.rows.replace(user, lambda row: patched(row, list_id, drop))
+        self.columns.replace(list_id, lambda column: patched(column, user, drop))
+
+
+share_index = ShareIndex(policy_index_size, policy_index_ttl)
+
+
+def permissions_check(avp_principal: str, action: str, task_list: List) -> str:
+    key = decision_key(avp_principal, action, task_list)
+    decision = decision_cache.get(key)
+    if decision is not None:
+        return decision
+
+    if LOCAL_AUTHORIZATION == "on":
+        try:
+            decision = local_decision(avp_principal, action, task_list)
+        except Exception as e:
+            warning("Local authorization unavailable, asking Verified Permissions: %s", e)
+            decision = remote_decision(avp_principal, action, task_list)
+    else:
+        decision = remote_decision(avp_principal, action, task_list)
+        if LOCAL_AUTHORIZATION == "shadow":
+            concurrency.submit(shadow_check, avp_principal, action, task_list, decision)
+    decision_cache.put(key, decision)
+    return decision
+
+
+def local_decision(avp_principal: str, action: str, task_list: List) -> str:
+    snapshot = policy_snapshot()
+    if snapshot.unsupported:
+        raise cedar.Unsupported(snapshot.unsupported)
+
+    principal = ("TinyTodo::User", avp_principal)
+    if task_list:
+        resource = ("TinyTodo::List", str(task_list.id))
+        entities = {resource: {"owner": ("TinyTodo::User", task_list.owner)}}
+    else:
+        resource = ("TinyTodo::Application", "TinyTodo")
+        entities = {}
+    request = cedar.Request(principal, ("TinyTodo::Action", action), resource, entities, snapshot.action_ancestors)
+
+    # Links of compiled templates are a set lookup; anything else is evaluated with the static policies
+    policies = [(policy, None) for policy in snapshot.static]
+    slots = {"?principal": principal, "?resource": resource}
+    permitted = False
+    for link in share_index.links(avp_principal, task_list.id) if task_list else ():
+        if link.template_id not in snapshot.templates:
+            raise cedar.Unsupported(f"template {link.template_id} is not in the snapshot")
+        actions = snapshot.template_actions[link.template_id]
+        if actions is None:
+            policies.extend((policy, slots) for policy in snapshot.templates[link.template_id])
+        elif request.action in actions:
+            permitted = True
+    return "ALLOW" if cedar.is_authorized(policies, request, permitted) else "DENY"
+
+
+def shadow_check(avp_principal: str, action: str, task_list: List, remote: str) -> None:
+    try:
+        local = local_decision(avp_principal, action, task_list)
+    except Exception as e:
+        warning("Local authorization unavailable: %s", e)
+        outcome = "unavailable"
+    else:
+        outcome = "matched" if local == remote else "mismatched"
+        if local != remote:
+            warning(
+                lambda: {
+                    "authorizationMismatch": {
+                        "principal": avp_principal,
+                        "action": action,
+                        "list": task_list.id if task_list else None,
+                        "remote": remote,
+                        "local": local,
+                    }
+                }
+            )
+    with shadow_stats_lock:
+        shadow_stats[outcome] += 1
+
+
+def remote_decision(avp_principal: str, action: str, task_list: List) -> str:
     args = {
         "policyStoreId": POLICY_STORE_ID,
         "principal": entity("User", avp_principal),
@@ -58,8 +316,7 @@ def permissions_check(avp_principal: str, action: str, task_list: List) -> bool:
         }
 
     debug_object(args)
-    resp = avp.is_authorized(**args)
-    return resp["decision"]
+    return avp.is_authorized(**args)["decision"]
 
 
 def permissions_check_token(token: str, action: str, task_list: List) -> bool:
@@ -89,83 +346,150 @@ def permissions_check_token(token: str, action: str, task_list: List) -> bool:
 
 
 def create_share(list_id: int, user: str, role: str) -> None:
-    print("Creating template-linked policy")
+    from botocore.exceptions import ClientError
+
+    # A share made before records existed has no record to fail put_share below, only its link
+    if policy_links(list_id, user):
+        raise ShareExists(f"{user} on list {list_id}")
+    try:
+        link = create_link(list_id, user, role_template(role))
+    except ClientError as e:
+        # The same template is already linked for this user and list
+        if e.response["Error"]["Code"] != "ConflictException":
+            raise
+        raise ShareExists(f"{user} on list {list_id}")
+    try:
+        database.put_share(list_id, user, role, link.policy_id, new=True)
+    except database.ShareExists:
+        # Another share of this list with this user got there first; it stays the only one
+        delete_link(list_id, user, link.policy_id)
+        raise ShareExists(f"{user} on list {list_id}")
+
+
+def create_link(list_id: int, user: str, template_id: str) -> ShareLink:
+    info("Creating template-linked policy")
     principal = entity("User", user)
     resource = entity("List", str(list_id))
-    template_id = TASK_LIST_EDITOR_TEMPLATE_ID if role == "editor" else TASK_LIST_VIEWER_TEMPLATE_ID
     templateLinkedDef = {
         "templateLinked": {"policyTemplateId": template_id, "principal": principal, "resource": resource}
     }
     templateLinked = avp.create_policy(policyStoreId=POLICY_STORE_ID, definition=templateLinkedDef)
     debug_object(templateLinked)
+    link = ShareLink(templateLinked["policyId"], template_id)
+    share_index.add(user, list_id, link)
+    invalidate_decisions(list_id, user)
+    return link
 
 
-def policy_to_share(policy) -> Share:
-    user = policy["principal"]["entityId"]
-    role = (
-        "editor"
-        if policy["definition"]["templateLinked"]["policyTemplateId"] == TASK_LIST_EDITOR_TEMPLATE_ID
-        else "viewer"
-    )
-    return Share(user, role)
+def role_template(role: str) -> str:
+    return TASK_LIST_EDITOR_TEMPLATE_ID if role == "editor" else TASK_LIST_VIEWER_TEMPLATE_ID
+
+
+def links_role(links: tuple) -> str:
+    # A user linked to one list by both templates (briefly, while a role changes) counts as an editor
+    return "editor" if any(link.template_id == TASK_LIST_EDITOR_TEMPLATE_ID for link in links) else "viewer"
 
 
 def list_shares(list_id: int) -> list[Share]:
-    resp = avp.list_policies(
-        policyStoreId=POLICY_STORE_ID, filter={"resource": {"identifier": entity("List", list_id)}}
-    )
-    return [policy_to_share(policy) for policy in resp["policies"]]
+    if SHARE_READS == "records":
+        return database.list_shares(list_id)
+    return [Share(user, links_role(links)) for user, links in share_index.column(list_id).items()]
 
 
 def list_shared_lists(user: str) -> list[SharedList]:
-    resp = avp.list_policies(
-        policyStoreId=POLICY_STORE_ID,
-        filter={"principal": {"identifier": entity("User", user)}},
-    )
-    print(f"User {user} has {len(resp['policies'])} policies")
-    debug_object(resp["policies"])
+    if SHARE_READS == "records":
+        roles = database.list_shared(user)
+    else:
+        roles = {list_id: links_role(links) for list_id, links in share_index.row(user).items()}
+    info("User %s has %d shared lists", user, len(roles))
 
+    list_ids = list(roles)
     result = []
-    for policy in resp["policies"]:
-        list_id = int(policy["resource"]["entityId"])
-        role = (
-            "editor"
-            if policy["definition"]["templateLinked"]["policyTemplateId"] == TASK_LIST_EDITOR_TEMPLATE_ID
-            else "viewer"
-        )
-        try:
-            list = database.get_list(list_id)
-            result.append(SharedList.from_list(list, role))
-        except KeyError:
+    for list_id, task_list in zip(list_ids, database.get_lists(list_ids)):
+        if task_list is None:
             # Share references a deleted list, ignore it
-            pass
+            continue
+        result.append(SharedList.from_list(task_list, roles[list_id]))
     return result
 
 
-def get_sharing_policy(list_id: int, user: str):
-    policies = list_sharing_policies(list_id, user)
-    # Based on how we create shares, there should never be more than one policy in this list
-    assert len(policies) == 1
-    return policies[0]
+def list_sharing_policies(list_id: int, user: str):
+    return list(
+        iter_policies(
+            principal={"identifier": entity("User", user)},
+            resource={"identifier": entity("List", list_id)},
+        )
+    )
 
 
-def list_sharing_policies(list_id: int, user: str):
-    resp = avp.list_policies(
-        policyStoreId=POLICY_STORE_ID,
-        filter={
-            "principal": {"identifier": entity("User", user)},
-            "resource": {"identifier": entity("List", list_id)},
-        },
+def sharing_links(list_id: int, user: str) -> tuple:
+    # The share's record names its policy. Shares without one (made before records existed) are looked up in the
+    # policy store.
+    record = database.get_share(list_id, user)
+    if record is not None:
+        return (ShareLink(record["policyId"], role_template(record["role"])),)
+    return policy_links(list_id, user)
+
+
+def policy_links(list_id: int, user: str) -> tuple:
+    # Every link of the user to the list, recorded or not. The share index is asked first, and the policy store is
+    # only listed when the index knows of none, as it may lag behind shares made elsewhere.
+    links = share_index.links(user, list_id)
+    if links:
+        return links
+    return tuple(
+        ShareLink(policy["policyId"], policy["definition"]["templateLinked"]["policyTemplateId"])
+        for policy in list_sharing_policies(list_id, user)
+        if "templateLinked" in policy["definition"]
     )
-    return resp["policies"]
 
 
 def update_share(list_id: int, user: str, role: str) -> None:
-    # This is non-atomic, so we hope nothing goes wrong halfway through
-    delete_share(list_id, user)
-    create_share(list_id, user, role)
+    # UpdatePolicy cannot move a template-linked policy to another template, so the link for the new role is created
+    # before the old one is deleted: the user keeps access throughout, and an unchanged role costs no policy store call
+    links = sharing_links(list_id, user)
+    if not links:
+        raise ShareNotFound(f"{user} on list {list_id}")
+    template_id = role_template(role)
+    if not any(link.template_id == template_id for link in links):
+        link = create_link(list_id, user, template_id)
+        try:
+            database.put_share(list_id, user, role, link.policy_id)
+        except Exception:
+            # The record still names the old link, which is kept; undo the new one as create_share does
+            delete_link(list_id, user, link.policy_id)
+            raise
+    for link in links:
+        if link.template_id != template_id:
+            delete_link(list_id, user, link.policy_id)
 
 
 def delete_share(list_id: int, user: str) -> None:
-    policy = get_sharing_policy(list_id, user)
-    avp.delete_policy(policyStoreId=POLICY_STORE_ID, policyId=policy["policyId"])
+    # Besides the recorded link, any other link of the user to the list (e.g. one made before records existed)
+    # would keep granting access. The policy store is listed, not the share index, which may lag behind it.
+    policy_ids = [
+        policy["policyId"]
+        for policy in list_sharing_policies(list_id, user)
+        if "templateLinked" in policy["definition"]
+    ]
+    record = database.get_share(list_id, user)
+    if record is not None and record["policyId"] not in policy_ids:
+        policy_ids.append(record["policyId"])
+    if not policy_ids:
+        raise ShareNotFound(f"{user} on list {list_id}")
+    for policy_id in policy_ids:
+        delete_link(list_id, user, policy_id)
+        database.delete_share(list_id, user, policy_id)
+
+
+def delete_link(list_id: int, user: str, policy_id: str) -> None:
+    from botocore.exceptions import ClientError
+
+    try:
+        avp.delete_policy(policyStoreId=POLICY_STORE_ID, policyId=policy_id)
+    except ClientError as e:
+        # Deleted elsewhere since the index was loaded
+        if e.response["Error"]["Code"] != "ResourceNotFoundException":
+            raise
+    share_index.remove(user, list_id, policy_id)
+    invalidate_decisions(list_id, user)
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+from cache import TTLCache
+from util import info, warning
+
+# e.g. https://cognito-idp.us-east-1.amazonaws.com/us-east-1_AbCdEf123. Without it tokens are decoded unverified,
+# which relies on the API Gateway Cognito authorizer having checked them already.
+COGNITO_ISSUER = os.environ.get("COGNITO_ISSUER", "")
+COGNITO_CLIENT_ID = os.environ.get("COGNITO_CLIENT_ID", "")
+ALGORITHMS = ["RS256"]
+# An unknown kid triggers at most one JWKS fetch per interval, so forged kids cannot turn into a fetch per request
+MIN_KEY_REFRESH_INTERVAL = 60
+
+# jwt and jose (with rsa, pyasn1 and ecdsa behind it) are imported on first use rather than at cold start
+
+
+class InvalidToken(Exception):
+    pass
+
+
+class TokenValidator:
+    def __init__(self, issuer: str, client_id: str = ""):
+        self.issuer = issuer
+        self.client_id = client_id
+        # Only the raw JWKS download and its cache are used from PyJWT: building a PyJWK for an RSA key needs the
+        # cryptography package, which is not bundled, so keys are parsed with the pure-python jose backend.
+        import jwt
+
+        self.jwks_client = jwt.PyJWKClient(f"{issuer}/.well-known/jwks.json", lifespan=3600)
+        self.keys: dict = {}
+        self.keys_fetched_at = 0.0
+        self.refresh_lock = threading.Lock()
+        self.verified = TTLCache(maxsize=int(os.environ.get("VERIFIED_TOKEN_CACHE_SIZE", "4096")), ttl=3600)
+
+    def warm(self) -> None:
+        # Runs at import, so any failure (a timeout or URLError included) falls back to fetching the keys on first use
+        # rather than failing the cold start
+        try:
+            self.refresh_keys()
+        except Exception as e:
+            warning("Could not pre-fetch signing keys: %s", e)
+
+    def refresh_keys(self, kid: Optional[str] = None) -> None:
+        from jose import jwk
+
+        # Single flight: concurrent callers wait for the fetch in progress and then reuse its result
+        with self.refresh_lock:
+            recently_fetched = time.monotonic() - self.keys_fetched_at < MIN_KEY_REFRESH_INTERVAL
+            if kid is not None and (kid in self.keys or recently_fetched):
+                return
+            jwk_set = self.jwks_client.fetch_data()
+            self.keys = {
+                key["kid"]: jwk.construct(key, key.get("alg", "RS256"))
+                for key in jwk_set["keys"]
+                if "kid" in key and key.get("use", "sig") == "sig"
+            }
+            self.keys_fetched_at = time.monotonic()
+            info("Loaded signing keys %s", sorted(self.keys))
+
+    def signing_key(self, kid: Optional[str]):
+        if not kid:
+            raise InvalidToken("token has no key id")
+        key = self.keys.get(kid)
+        if key is None:
+            import jwt
+            from jose.exceptions import JOSEError
+
+            try:
+                self.refresh_keys(kid)
+            except (jwt.PyJWKClientError, JOSEError) as e:
+                raise InvalidToken(f"cannot load signing keys: {e}")
+            key = self.keys.get(kid)
+            if key is None:
+                raise InvalidToken(f"unknown signing key {kid}")
+        return key
+
+    def validate(self, token: str) -> dict:
+        now = time.time()
+        digest = hashlib.sha256(token.encode()).digest()
+        claims = self.verified.get(digest)
+        if claims is not None and claims["exp"] > now:
+            return claims
+
+        from jose import jws
+        from jose.exceptions import JOSEError
+
+        try:
+            key = self.signing_key(jws.get_unverified_header(token).get("kid"))
+            claims = json.loads(jws.verify(token, key, ALGORITHMS))
+        except (JOSEError, ValueError) as e:
+            raise InvalidToken(str(e))
+
+        if claims.get("iss") != self.issuer:
+            raise InvalidToken("wrong issuer")
+        if claims.get("token_use") != "access":
+            raise InvalidToken("not an access token")
+        if self.client_id and claims.get("client_id") != self.client_id:
+            raise InvalidToken("wrong client")
+        if not isinstance(claims.get("exp"), (int, float)) or claims["exp"] <= now:
+            raise InvalidToken("token expired")
+
+        self.verified.put(digest, claims, ttl=claims["exp"] - now)
+        return claims
+
+
+def decode_access_token(token: str) -> dict:
+    if validator is not None:
+        return validator.validate(token)
+
+    import jwt
+
+    try:
+        return jwt.decode(token, options={"verify_signature": False})
+    except jwt.PyJWTError as e:
+        raise InvalidToken(str(e))
+
+
+validator = TokenValidator(COGNITO_ISSUER, COGNITO_CLIENT_ID) if COGNITO_ISSUER else None
+if validator is not None:
+    validator.warm()
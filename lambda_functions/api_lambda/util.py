@@ -1,5 +1,49 @@
 import json
+import os
 
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+OFF = 100
+LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "ERROR": ERROR, "OFF": OFF}
+LEVEL_NAMES = {level: name for name, level in LEVELS.items()}
 
-def debug_object(obj: object) -> None:
-    print(json.dumps(obj, indent=2, default=str).replace("\n", "\r"))
+# LOG_LEVEL gates every record before anything is serialised; LOG_FORMAT=compact emits one JSON object per line
+# instead of the indented dumps (which CloudWatch only keeps together because newlines are swapped for \r).
+log_level = LEVELS.get(os.environ.get("LOG_LEVEL", "DEBUG").upper(), DEBUG)
+compact = os.environ.get("LOG_FORMAT", "pretty").lower() == "compact"
+
+
+def log(level: int, obj: object, *args) -> None:
+    if level < log_level:
+        return
+
+    # Expensive records can be passed as a callable (or a %-format string plus args) so that building them is
+    # also skipped when the level is disabled
+    if callable(obj):
+        obj = obj()
+    elif args:
+        obj = obj % args
+    emit(level, obj)
+
+
+def emit(level: int, obj: object) -> None:
+    if compact:
+        print(json.dumps({"level": LEVEL_NAMES[level], "message": obj}, default=str, separators=(",", ":")))
+    elif isinstance(obj, str):
+        print(obj)
+    else:
+        print(json.dumps(obj, indent=2, default=str).replace("\n", "\r"))
+
+
+def debug_object(obj: object, *args) -> None:
+    log(DEBUG, obj, *args)
+
+
+def info(obj: object, *args) -> None:
+    log(INFO, obj, *args)
+
+
+def warning(obj: object, *args) -> None:
+    log(WARNING, obj, *args)
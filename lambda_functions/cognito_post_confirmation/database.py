@@ -1,12 +1,30 @@
 from decimal import Decimal
+from typing import Optional
+import os
+import random
+import time
 
 import boto3
 from boto3.dynamodb.conditions import Key
-from botocore.exceptions import ClientError
+from boto3.dynamodb.types import TypeSerializer
 
 dynamodb = boto3.resource("dynamodb")
 table = dynamodb.Table("TinyTodoTable")
 OWNER_LIST_ID_INDEX = "OwnerListIdIndex"
+TRANSACT_WRITE_LIMIT = 100
+
+# List IDs are reserved a block at a time, so most sign-ups in a warm container do not touch a counter at all. They
+# come from the same counters as the API function's, following the same LIST_ID_STRATEGY and LIST_ID_SHARDS (see
+# api_lambda/database.py and api_lambda/ids.py), which must be set alike on both functions.
+LIST_ID_BLOCK = int(os.environ.get("LIST_ID_BLOCK", "10"))
+LIST_ID_STRATEGY = os.environ.get("LIST_ID_STRATEGY", "counter").lower()
+LIST_ID_SHARDS = int(os.environ.get("LIST_ID_SHARDS", "8"))
+# Time-sortable IDs: seconds since 2023-01-01T00:00:00Z << SEQUENCE_BITS | low bits of a counter ID
+ID_EPOCH = 1672531200
+SEQUENCE_BITS = 21
+reserved_list_ids = iter(())
+shard_floor = None
+serializer = TypeSerializer()
 
 
 def list_key(list_id: int) -> str:
@@ -33,67 +51,93 @@ def create_user(userId: str, userName: str):
     )
 
 
-def create_list(userId: str, name: str, description: str) -> int:
-    try:
-        response = table.get_item(Key={"pk": "GLOBAL", "sk": "GLOBAL"})
-        if "Item" not in response:
-            # item does not exist, create it
-            table.put_item(Item={"pk": "GLOBAL", "sk": "GLOBAL", "nextListId": Decimal("1")})
-            attributes = {"nextListId": Decimal("1")}
-        else:
-            attributes = response["Item"]
-    except ClientError as e:
-        # unexpected error, re-raise exception
-        raise e
+def lease_counter(key: dict, count: int, floor: int = 1) -> range:
+    attributes = table.update_item(
+        Key=key,
+        UpdateExpression="SET nextListId = if_not_exists(nextListId, :floor) + :count",
+        ExpressionAttributeValues={":floor": Decimal(floor), ":count": Decimal(count)},
+        ReturnValues="UPDATED_NEW",
+    )["Attributes"]
+    end = int(attributes["nextListId"])
+    return range(end - count, end)
+
+
+def lease_list_ids(count: int) -> range:
+    global shard_floor
+    if LIST_ID_STRATEGY != "sharded":
+        return lease_counter({"pk": "GLOBAL", "sk": "GLOBAL"}, count)
+
+    # Value v of shard s stands for ID v * LIST_ID_SHARDS + s; shard counters start above every ID the single
+    # counter has handed out
+    if shard_floor is None:
+        item = table.get_item(Key={"pk": "GLOBAL", "sk": "GLOBAL"}, ConsistentRead=True).get("Item", {})
+        shard_floor = -(-int(item.get("nextListId", 1)) // LIST_ID_SHARDS)
+    shard = random.randrange(LIST_ID_SHARDS)
+    values = lease_counter({"pk": f"GLOBAL#{shard}", "sk": "GLOBAL"}, count, shard_floor)
+    return range(values.start * LIST_ID_SHARDS + shard, values.stop * LIST_ID_SHARDS + shard, LIST_ID_SHARDS)
+
+
+def next_list_id() -> int:
+    global reserved_list_ids
+    list_id = next(reserved_list_ids, None)
+    if list_id is None:
+        reserved_list_ids = iter(lease_list_ids(LIST_ID_BLOCK))
+        list_id = next(reserved_list_ids)
+    if LIST_ID_STRATEGY == "time":
+        return (int(time.time()) - ID_EPOCH) << SEQUENCE_BITS | (list_id & ((1 << SEQUENCE_BITS) - 1))
+    return list_id
 
-    list_id = int(attributes["nextListId"])
 
-    table.put_item(
-        Item={
+def create_list(userId: str, name: str, description: str, tasks: Optional[list] = None) -> int:
+    # The list and its tasks are written in one TransactWriteItems, so a failed sign-up never leaves a list
+    # without its tasks behind. Tasks beyond the transaction limit are added with a batch writer afterwards.
+    list_id = next_list_id()
+    tasks = tasks or []
+    items = [
+        {
             "pk": list_key(list_id),
             "sk": "DETAILS",
             "name": name,
             "description": description,
             "listId": Decimal(list_id),
             "owner": userId,
-            "nextTaskId": Decimal(1),
+            "nextTaskId": Decimal(len(tasks) + 1),
+            # Counts the tasks written below too: nothing else can reach the list before this returns
+            "taskCount": Decimal(len(tasks)),
         }
+    ]
+    for task_id, task in enumerate(tasks, 1):
+        items.append(
+            {
+                "pk": list_key(list_id),
+                "sk": task_key(task_id),
+                "name": task["name"],
+                "description": task["description"],
+                "listId": Decimal(list_id),
+                "taskId": Decimal(task_id),
+            }
+        )
+
+    dynamodb.meta.client.transact_write_items(
+        TransactItems=[
+            {
+                "Put": {
+                    "TableName": table.name,
+                    "Item": {key: serializer.serialize(value) for key, value in item.items()},
+                    "ConditionExpression": "attribute_not_exists(pk)",
+                }
+            }
+            for item in items[:TRANSACT_WRITE_LIMIT]
+        ]
     )
-
-    # increment nextListId for the next list
-    table.update_item(
-        Key={"pk": "GLOBAL", "sk": "GLOBAL"},
-        UpdateExpression="SET nextListId = nextListId + :one",
-        ExpressionAttributeValues={":one": Decimal("1")},
-    )
+    if len(items) > TRANSACT_WRITE_LIMIT:
+        with table.batch_writer() as batch:
+            for item in items[TRANSACT_WRITE_LIMIT:]:
+                batch.put_item(Item=item)
 
     return list_id
 
 
-def create_task(list_id: int, name: str, description: str) -> int:
-    attributes = table.update_item(
-        Key={"pk": list_key(list_id), "sk": "DETAILS"},
-        UpdateExpression="ADD nextTaskId :one",
-        ExpressionAttributeValues={":one": Decimal("1")},
-        ReturnValues="UPDATED_OLD",
-    )["Attributes"]
-
-    task_id = int(attributes["nextTaskId"])
-
-    table.put_item(
-        Item={
-            "pk": list_key(list_id),
-            "sk": task_key(task_id),
-            "name": name,
-            "description": description,
-            "listId": Decimal(list_id),
-            "taskId": Decimal(task_id),
-        }
-    )
-
-    return task_id
-
-
 def count_lists(userId: str) -> int:
     return table.query(
         IndexName=OWNER_LIST_ID_INDEX,
@@ -26,9 +26,7 @@ def handler(event, context) -> Response:
         with open("resources/starter-list.json") as starter_list_file:
             starter_list = json.load(starter_list_file)
 
-        list_id = database.create_list(userId, starter_list["name"], starter_list["description"])
-        for task in starter_list["tasks"]:
-            database.create_task(list_id, task["name"], task["description"])
+        database.create_list(userId, starter_list["name"], starter_list["description"], starter_list["tasks"])
         return event
     else:
         return event
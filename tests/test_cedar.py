@@ -0,0 +1,153 @@
+# Tests of the in-process Cedar evaluator: the parser and evaluator on their own, and local decisions for TinyTodo's
+# policy store (the static policies, templates and schema the fakes serve, as deployed) against the decisions
+# Verified Permissions makes for it.
+#
+#   python -m pytest tests
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "benchmarks"))
+sys.path.insert(0, os.path.join(HERE, "..", "lambda_functions", "api_lambda"))
+
+import fakes  # noqa: E402
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("LOG_LEVEL", "OFF")
+os.environ["POLICY_STORE_ID"] = fakes.POLICY_STORE_ID
+os.environ["TASK_LIST_EDITOR_TEMPLATE_ID"] = fakes.EDITOR_TEMPLATE_ID
+os.environ["TASK_LIST_VIEWER_TEMPLATE_ID"] = fakes.VIEWER_TEMPLATE_ID
+
+import cedar  # noqa: E402
+import permissions  # noqa: E402
+from api_types import List  # noqa: E402
+
+USER = ("TinyTodo::User", "alice")
+OTHER = ("TinyTodo::User", "bob")
+LIST = ("TinyTodo::List", "1")
+ACTION = ("TinyTodo::Action", "ReadList")
+
+
+def decide(text: str, principal=USER, action=ACTION, resource=LIST, entities=None, ancestors=None) -> bool:
+    request = cedar.Request(principal, action, resource, entities or {}, ancestors or {})
+    return cedar.is_authorized([(policy, None) for policy in cedar.parse(text)], request)
+
+
+def test_not_binds_tighter_than_equality():
+    (policy,) = cedar.parse("permit (principal, action, resource) when { !context.a == false };")
+    assert policy.conditions == [(True, ("==", ("not", ("attr", ("var", "context"), "a")), ("value", False)))]
+    # Negating a string is an error, which makes Cedar ignore the policy; negating the comparison would permit
+    entities = {USER: {"name": "bob", "flag": True}}
+    assert not decide('permit (principal, action, resource) when { !principal.name == "alice" };', entities=entities)
+    assert decide('permit (principal, action, resource) when { !(principal.name == "alice") };', entities=entities)
+    assert decide("permit (principal, action, resource) when { !!principal.flag };", entities=entities)
+
+
+def test_and_binds_tighter_than_or():
+    entities = {USER: {"a": True, "b": False}}
+    text = "permit (principal, action, resource) when { principal.a || principal.b && principal.b };"
+    assert decide(text, entities=entities)
+    text = "permit (principal, action, resource) when { (principal.a || principal.b) && principal.b };"
+    assert not decide(text, entities=entities)
+
+
+def test_scopes():
+    assert decide('permit (principal == TinyTodo::User::"alice", action, resource);')
+    assert not decide('permit (principal == TinyTodo::User::"alice", action, resource);', principal=OTHER)
+    assert decide('permit (principal, action == TinyTodo::Action::"ReadList", resource is TinyTodo::List);')
+    assert not decide("permit (principal, action, resource is TinyTodo::Application);")
+    ancestors = {ACTION: frozenset([("TinyTodo::Action", "Reads")])}
+    assert decide('permit (principal, action in TinyTodo::Action::"Reads", resource);', ancestors=ancestors)
+    assert not decide('permit (principal, action in TinyTodo::Action::"Reads", resource);')
+
+
+def test_forbid_overrides_permit_and_nothing_matching_denies():
+    assert not decide("permit (principal, action, resource); forbid (principal, action, resource);")
+    assert not decide("forbid (principal, action, resource is TinyTodo::Application);")
+
+
+def test_conditions_that_fail_to_evaluate_are_ignored():
+    assert not decide("permit (principal, action, resource) when { resource.owner == principal };")
+    assert decide(
+        "permit (principal, action, resource); forbid (principal, action, resource) when { resource.missing };"
+    )
+
+
+def test_annotations_comments_and_escapes():
+    text = '// shared\n@id("p") permit (principal == TinyTodo::User::"a\\"b", action, resource); // done'
+    assert decide(text, principal=("TinyTodo::User", 'a"b'))
+
+
+def test_action_ancestors_follow_groups_transitively():
+    schema = {
+        "TinyTodo": {
+            "actions": {"All": {}, "Reads": {"memberOf": [{"id": "All"}]}, "ReadList": {"memberOf": [{"id": "Reads"}]}}
+        }
+    }
+    ancestors = cedar.action_ancestors(schema)
+    assert ancestors[ACTION] == {("TinyTodo::Action", "Reads"), ("TinyTodo::Action", "All")}
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "permit (principal, action, resource) when { principal.name.contains(1) };",
+        'permit (principal, action, resource) when { principal.name like "a*" };',
+        "permit (principal, action, resource) when { principal has name };",
+        "permit (principal, action, resource)",
+        "allow (principal, action, resource);",
+    ],
+)
+def test_unsupported_syntax_is_rejected(text):
+    with pytest.raises(cedar.Unsupported):
+        cedar.parse(text)
+
+
+# What Verified Permissions decides for TinyTodo's policies: the application actions on the application, any action
+# on a list for its owner (the owner policy does not constrain the action), and the template's actions for a user
+# the list is shared with
+APPLICATION_ACTIONS = {"CreateList", "ListLists", "ListSharedLists"}
+VIEWER_ACTIONS = {"ReadList", "ListTasks", "ReadTask"}
+EDITOR_ACTIONS = VIEWER_ACTIONS | {"UpdateList", "CreateTask", "UpdateTask", "DeleteTask"}
+LIST_ACTIONS = EDITOR_ACTIONS | {"DeleteList", "ListShares", "ReadShare", "CreateShare", "UpdateShare", "DeleteShare"}
+ALL_ACTIONS = sorted(APPLICATION_ACTIONS | LIST_ACTIONS)
+GRANTED = {
+    "application": APPLICATION_ACTIONS,
+    "owner": set(ALL_ACTIONS),
+    "editor": EDITOR_ACTIONS,
+    "viewer": VIEWER_ACTIONS,
+    "stranger": set(),
+}
+
+
+@pytest.fixture
+def store():
+    avp = fakes.FakeVerifiedPermissions()
+    avp.link(fakes.EDITOR_TEMPLATE_ID, "editor", 1)
+    avp.link(fakes.VIEWER_TEMPLATE_ID, "viewer", 1)
+    permissions.avp = avp
+    permissions.policy_snapshot_cache.clear()
+    permissions.share_index.rows.clear()
+    permissions.share_index.columns.clear()
+    return avp
+
+
+@pytest.mark.parametrize("relation", sorted(GRANTED))
+@pytest.mark.parametrize("action", ALL_ACTIONS)
+def test_local_decisions_match_verified_permissions(store, relation, action):
+    principal = "owner" if relation in ("owner", "application") else relation
+    task_list = None if relation == "application" else List(1, "owner", "List", "")
+    expected = "ALLOW" if action in GRANTED[relation] else "DENY"
+    assert permissions.local_decision(principal, action, task_list) == expected
+    assert permissions.remote_decision(principal, action, task_list) == expected
+
+
+def test_bundled_templates_compile_to_action_sets(store):
+    snapshot = permissions.policy_snapshot()
+    assert not snapshot.unsupported
+    actions = {
+        template_id: {action for _, action in granted} for template_id, granted in snapshot.template_actions.items()
+    }
+    assert actions == {fakes.EDITOR_TEMPLATE_ID: EDITOR_ACTIONS, fakes.VIEWER_TEMPLATE_ID: VIEWER_ACTIONS}
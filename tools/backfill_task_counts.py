@@ -0,0 +1,96 @@
+# Sets taskCount on the DETAILS item of every list to the number of tasks the list actually holds.
+#
+# REQUIRED deploy step: run it once every API lambda container is on a version that maintains taskCount. Lists
+# created earlier have no taskCount, and the API keeps taking the slow path for them (counting their tasks on
+# DeleteList) until this has run. It also repairs lists whose count an earlier version started from zero.
+#
+# Each list is fixed with an optimistic loop (read the count, count the tasks, write the new count on condition the
+# old one and the list's taskWrites, bumped by every task write to a list without taskCount, are unchanged), so it is
+# safe to run against a live table.
+#
+#   python tools/backfill_task_counts.py --dry-run
+#   python tools/backfill_task_counts.py --table TinyTodoTable
+import argparse
+
+import boto3
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+
+
+def details_items(table):
+    kwargs = {"FilterExpression": Attr("sk").eq("DETAILS") & Attr("pk").begins_with("LIST#")}
+    while True:
+        resp = table.scan(**kwargs)
+        yield from resp["Items"]
+        if "LastEvaluatedKey" not in resp:
+            return
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def count_tasks(table, pk: str) -> int:
+    kwargs = {
+        "KeyConditionExpression": Key("pk").eq(pk) & Key("sk").begins_with("TASK#"),
+        "Select": "COUNT",
+        "ConsistentRead": True,
+    }
+    count = 0
+    while True:
+        resp = table.query(**kwargs)
+        count += resp["Count"]
+        if "LastEvaluatedKey" not in resp:
+            return count
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def backfill(table, pk: str, dry_run: bool):
+    # Returns (old count, new count), or None when the list was deleted meanwhile
+    key = {"pk": pk, "sk": "DETAILS"}
+    while True:
+        item = table.get_item(Key=key, ConsistentRead=True).get("Item")
+        if item is None:
+            return None
+        old = item.get("taskCount")
+        writes = item.get("taskWrites")
+        new = count_tasks(table, pk)
+        if dry_run or (old == new and writes is None):
+            return old, new
+        if old is None:
+            condition = Attr("taskCount").not_exists()
+        else:
+            condition = Attr("taskCount").eq(old)
+        if writes is None:
+            condition &= Attr("taskWrites").not_exists()
+        else:
+            condition &= Attr("taskWrites").eq(writes)
+        try:
+            table.update_item(
+                Key=key,
+                UpdateExpression="SET taskCount = :count REMOVE taskWrites",
+                ConditionExpression=condition & Attr("pk").exists(),
+                ExpressionAttributeValues={":count": new},
+            )
+            return old, new
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--table", default="TinyTodoTable")
+    parser.add_argument("--dry-run", action="store_true", help="report the counts that would change")
+    args = parser.parse_args()
+
+    table = boto3.resource("dynamodb").Table(args.table)
+    checked = changed = 0
+    for item in details_items(table):
+        result = backfill(table, item["pk"], args.dry_run)
+        checked += 1
+        if result is not None and result[0] != result[1]:
+            changed += 1
+            print(f"{item['pk']}: taskCount {result[0]} -> {result[1]}")
+    print(f"{checked} lists checked, {changed} {'to update' if args.dry_run else 'updated'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# Compares the share records in TinyTodoTable (LIST#... / SHARE#<user> and SHARED#<user> / LIST#...) with the
+# template-linked policies of the policy store and repairs the records that have drifted from it: shares made before
+# the records existed, records a failed write left behind or half-written, and records of a role that has changed.
+# The policy store is the source of truth. Run it once before setting SHARE_READS=records, and again whenever the
+# two may have drifted.
+#
+# It is safe to run against a live table. Records are only rewritten on condition that they still hold what was
+# read, and a record naming a policy that the listing did not return is only removed once GetPolicy confirms that the
+# policy is gone (it may be a share made since the listing). A user linked to one list more than once (e.g. by a role
+# change that failed halfway) keeps the newest link; the older ones are deleted from the policy store.
+#
+# The policy store and template IDs default to the API lambda's POLICY_STORE_ID, TASK_LIST_EDITOR_TEMPLATE_ID and
+# TASK_LIST_VIEWER_TEMPLATE_ID variables.
+#
+#   python tools/reconcile_share_records.py --dry-run
+#   python tools/reconcile_share_records.py --policy-store-id ID --editor-template-id ID --viewer-template-id ID
+import argparse
+import os
+from collections import defaultdict
+from decimal import Decimal
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+
+def share_links(avp, policy_store_id: str, roles: dict) -> dict:
+    # (list id, user) -> template-linked policies of the share templates on that list, newest first
+    links = defaultdict(list)
+    kwargs = {"policyStoreId": policy_store_id, "filter": {"policyType": "TEMPLATE_LINKED"}}
+    while True:
+        resp = avp.list_policies(**kwargs)
+        for policy in resp["policies"]:
+            if policy["resource"]["entityType"] != "TinyTodo::List":
+                continue
+            if policy["definition"]["templateLinked"]["policyTemplateId"] not in roles:
+                continue
+            links[(int(policy["resource"]["entityId"]), policy["principal"]["entityId"])].append(policy)
+        if not resp.get("nextToken"):
+            break
+        kwargs["nextToken"] = resp["nextToken"]
+    for policies in links.values():
+        policies.sort(key=lambda policy: policy["createdDate"], reverse=True)
+    return links
+
+
+def share_records(table) -> dict:
+    # (list id, user) -> {"list": record next to the list, "user": record under the user}
+    records = defaultdict(dict)
+    kwargs = {"FilterExpression": Attr("sk").begins_with("SHARE#") | Attr("pk").begins_with("SHARED#")}
+    while True:
+        resp = table.scan(**kwargs)
+        for item in resp["Items"]:
+            side = "user" if item["pk"].startswith("SHARED#") else "list"
+            records[(int(item["listId"]), item["user"])][side] = item
+        if "LastEvaluatedKey" not in resp:
+            return records
+        kwargs["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+
+def record_key(side: str, list_id: int, user: str) -> dict:
+    if side == "list":
+        return {"pk": f"LIST#{list_id:06}", "sk": f"SHARE#{user}"}
+    return {"pk": f"SHARED#{user}", "sk": f"LIST#{list_id:06}"}
+
+
+def policy_exists(avp, policy_store_id: str, policy_id: str) -> bool:
+    try:
+        avp.get_policy(policyStoreId=policy_store_id, policyId=policy_id)
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ResourceNotFoundException":
+            raise
+        return False
+
+
+def reconcile(table, avp, args, roles: dict, share: tuple, policies: list, records: dict) -> list[str]:
+    # Repairs one share and returns what was (or, with --dry-run, would be) changed
+    list_id, user = share
+    changes = []
+    for policy in policies[1:]:
+        changes.append(f"delete duplicate policy {policy['policyId']}")
+        if not args.dry_run:
+            try:
+                avp.delete_policy(policyStoreId=args.policy_store_id, policyId=policy["policyId"])
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ResourceNotFoundException":
+                    raise
+
+    wanted = None
+    if policies:
+        policy = policies[0]
+        role = roles[policy["definition"]["templateLinked"]["policyTemplateId"]]
+        wanted = {"listId": Decimal(list_id), "user": user, "role": role, "policyId": policy["policyId"]}
+
+    for side in ("list", "user"):
+        current = records.get(side)
+        if current is not None and wanted is not None:
+            if current["role"] == wanted["role"] and current["policyId"] == wanted["policyId"]:
+                continue
+        if current is None and wanted is None:
+            continue
+        if current is not None and policy_exists(avp, args.policy_store_id, current["policyId"]):
+            if wanted is None or current["policyId"] != wanted["policyId"]:
+                changes.append(f"{side} record names {current['policyId']}, made since the listing: left alone")
+                continue
+
+        key = record_key(side, list_id, user)
+        if current is None:
+            condition = {"ConditionExpression": Attr("pk").not_exists()}
+        else:
+            condition = {"ConditionExpression": Attr("policyId").eq(current["policyId"])}
+        if wanted is None:
+            changes.append(f"delete {side} record of {current['policyId']}")
+        else:
+            changes.append(f"write {side} record: {wanted['role']} via {wanted['policyId']}")
+        if args.dry_run:
+            continue
+        try:
+            if wanted is None:
+                table.delete_item(Key=key, **condition)
+            else:
+                table.put_item(Item={**key, **wanted}, **condition)
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            changes[-1] += " (changed meanwhile, skipped)"
+    return changes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--table", default="TinyTodoTable")
+    parser.add_argument("--policy-store-id", default=os.environ.get("POLICY_STORE_ID"))
+    parser.add_argument("--editor-template-id", default=os.environ.get("TASK_LIST_EDITOR_TEMPLATE_ID"))
+    parser.add_argument("--viewer-template-id", default=os.environ.get("TASK_LIST_VIEWER_TEMPLATE_ID"))
+    parser.add_argument("--dry-run", action="store_true", help="report the repairs that would be made")
+    args = parser.parse_args()
+    if not (args.policy_store_id and args.editor_template_id and args.viewer_template_id):
+        parser.error("the policy store and both template IDs are required")
+
+    roles = {args.editor_template_id: "editor", args.viewer_template_id: "viewer"}
+    table = boto3.resource("dynamodb").Table(args.table)
+    avp = boto3.client("verifiedpermissions")
+    links = share_links(avp, args.policy_store_id, roles)
+    records = share_records(table)
+    shares = set(links) | set(records)
+    drifted = 0
+    for share in sorted(shares):
+        changes = reconcile(table, avp, args, roles, share, links.get(share, []), records.get(share, {}))
+        if changes:
+            drifted += 1
+            for change in changes:
+                print(f"LIST#{share[0]:06} {share[1]}: {change}")
+    print(f"{len(shares)} shares checked, {drifted} {'drifted' if args.dry_run else 'repaired'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# Writes the Verified Permissions service model bundled with the API lambda: the full model kept in
+# tools/models, trimmed to the operations the function calls plus every shape they reach. botocore parses the whole
+# file when the client is created, and most of the operations in it are internal ones the function never uses.
+# Rerun it after adding an operation to OPERATIONS, or after replacing the full model with a newer one.
+#
+#   python tools/trim_service_model.py
+#   python tools/trim_service_model.py --keep GetSchema --source path/to/service-2.json
+import argparse
+import json
+import os
+
+SOURCE = os.path.join(os.path.dirname(__file__), "models", "verifiedpermissions", "2021-12-01", "service-2.json")
+MODEL = os.path.join(
+    os.path.dirname(__file__),
+    "..",
+    "lambda_functions",
+    "api_lambda",
+    "models",
+    "verifiedpermissions",
+    "2021-12-01",
+    "service-2.json",
+)
+OPERATIONS = [
+    "CreatePolicy",
+    "DeletePolicy",
+    "GetPolicy",
+    "GetPolicyTemplate",
+    "GetSchema",
+    "IsAuthorized",
+    "IsAuthorizedWithToken",
+    "ListPolicies",
+    "ListPolicyTemplates",
+    "UpdatePolicy",
+]
+
+
+def shape_references(shape: dict):
+    for name in ("member", "key", "value"):
+        if name in shape:
+            yield shape[name]["shape"]
+    for member in shape.get("members", {}).values():
+        yield member["shape"]
+
+
+def reachable_shapes(model: dict, operations: list[str]) -> set[str]:
+    pending = []
+    for name in operations:
+        operation = model["operations"][name]
+        pending.extend(operation[part]["shape"] for part in ("input", "output") if part in operation)
+        pending.extend(error["shape"] for error in operation.get("errors", []))
+
+    seen = set()
+    while pending:
+        name = pending.pop()
+        if name not in seen:
+            seen.add(name)
+            pending.extend(shape_references(model["shapes"][name]))
+    return seen
+
+
+def trim(model: dict, operations: list[str]) -> dict:
+    missing = [name for name in operations if name not in model["operations"]]
+    if missing:
+        raise SystemExit(f"Unknown operations: {', '.join(missing)}")
+
+    shapes = reachable_shapes(model, operations)
+    return {
+        **model,
+        "operations": {name: op for name, op in model["operations"].items() if name in operations},
+        "shapes": {name: shape for name, shape in model["shapes"].items() if name in shapes},
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", default=SOURCE, help="full service model to trim")
+    parser.add_argument("--model", default=MODEL, help="trimmed model to write")
+    parser.add_argument("--keep", action="append", default=[], help="extra operation to keep")
+    args = parser.parse_args()
+
+    with open(args.source) as f:
+        model = json.load(f)
+    before = (len(model["operations"]), len(model["shapes"]))
+    model = trim(model, OPERATIONS + args.keep)
+    with open(args.model, "w") as f:
+        json.dump(model, f, indent=2, separators=(",", ":"))
+        f.write("\n")
+    print(f"operations {before[0]} -> {len(model['operations'])}, shapes {before[1]} -> {len(model['shapes'])}")
+
+
+if __name__ == "__main__":
+    main()